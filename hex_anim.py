@@ -1,49 +1,48 @@
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation,PillowWriter
-from functools import partial
+from matplotlib.animation import FuncAnimation
+from PIL import GifImagePlugin
+from PIL import Image
+from PIL import ImageDraw
 from os.path import isfile
+import struct
 import json
+import zlib
 
-end_marker = [None]
+class PatternAnimation:
+    # holds every artist for one animation, so nothing is created after the first frame
+    # and several animations can run at once without sharing state
 
-def animate_pattern(f,anim_data,ax,settings):
-    speed = 51-settings["anim_speed"]
-    x_anim,y_anim,scale = anim_data
-    global end_marker
-
-    # starting point
-    if x_anim[f] is None:
-        end_marker = plt.plot(x_anim[1],y_anim[1],marker='o',ms=1.8*scale,mew=0.4*scale,mec="black",c="#ff6bff")
-        
-    # segment going into a point
-    if f%speed == 1:
-        ax.plot(x_anim[f-1:f+1],y_anim[f-1:f+1],c=settings["animated_colors"][1],lw=scale)
-        ax.plot(x_anim[f],y_anim[f],marker='o',ms=1.8*scale,mew=0.4*scale,mec="black",c=settings["animated_colors"][1])
-    # segment coming out of a point
-    elif f%speed in (2,4):
-        ax.plot(x_anim[f-1:f+1],y_anim[f-1:f+1],c=settings["animated_colors"][1],lw=scale)
-        ax.plot(x_anim[f-f%speed+1],y_anim[f-f%speed+1],marker='o',ms=1.8*scale,mew=0.4*scale,mec="black",c=settings["animated_colors"][1])
-    # all other segments
-    else:
-        ax.plot(x_anim[f-1:f+1],y_anim[f-1:f+1],c=settings["animated_colors"][1],lw=scale)
-
-    # marker for current endpoint of animated line
-    if x_anim[f]:
-        end_marker[0].remove()
-        end_marker = ax.plot(x_anim[f],y_anim[f],marker='h',ms=2.4*scale,mew=0.5*scale,mec=settings["animated_colors"][3],c=settings["animated_colors"][2])
-        
-def init_pattern(plot_data,settings):
-    x_vals,y_vals,scale = plot_data[:3]
+    def __init__(self,plot_data,settings,ax):
+        x_vals,y_vals,scale = plot_data[:3]
+        colors = settings["animated_colors"]
+        self.speed = 51-settings["anim_speed"]
+        self.x_vals,self.y_vals = x_vals,y_vals
+        self.x_anim,self.y_anim = anim_interpolate(plot_data,self.speed)[:2]
 
-    # clear the canvas
-    plt.cla()
-    plt.gca().axis("off")
+        # draw the full pattern in the background, once
+        ax.plot(x_vals,y_vals,c=colors[0],lw=scale)
+        ax.plot(x_vals,y_vals,'ko',ms=2*scale)
+
+        # the animated line, the points it has reached, and the markers for its start and current end
+        self.line = ax.plot([],[],c=colors[1],lw=scale,animated=True)[0]
+        self.points = ax.plot([],[],ls="none",marker='o',ms=1.8*scale,mew=0.4*scale,mec="black",c=colors[1],animated=True)[0]
+        self.start = ax.plot(x_vals[0],y_vals[0],marker='o',ms=1.8*scale,mew=0.4*scale,mec="black",c="#ff6bff",animated=True)[0]
+        self.cursor = ax.plot([],[],marker='h',ms=2.4*scale,mew=0.5*scale,mec=colors[3],c=colors[2],animated=True)[0]
+        self.artists = (self.line,self.points,self.start,self.cursor)
+
+    def init(self):
+        return self.update(0)
+
+    def update(self,f):
+        # every frame is set from scratch, so frames can be drawn in any order
+        self.line.set_data(self.x_anim[1:f+1],self.y_anim[1:f+1])
+        reached = (f-1)//self.speed+1 if f else 0
+        self.points.set_data(self.x_vals[:reached],self.y_vals[:reached])
+        self.start.set_visible(f == 0)
+        if f: self.cursor.set_data([self.x_anim[f]],[self.y_anim[f]])
+        self.cursor.set_visible(f != 0)
+        return self.artists
 
-    # draw the full pattern in the background
-    for i in range(len(x_vals)-1):
-        plt.plot(x_vals[i:i+2],y_vals[i:i+2],c=settings["animated_colors"][0],lw=scale)
-        plt.plot(x_vals[i],y_vals[i],'ko',ms=2*scale)
-    plt.plot(x_vals[-1],y_vals[-1],'ko',ms=2*scale)
 '''
 def debug_init(plot_data,settings):
     plt.cla()
@@ -72,19 +71,163 @@ def anim_interpolate(plot_data,speed):
     return x_anim,y_anim,scale
 
 def plot_animated(plot_data,settings,ax):
-    # convert basic pointlist into special version for animating
-    anim_data = anim_interpolate(plot_data,51-settings["anim_speed"])
-
-    # create animation object by repeatedly invoking animate_pattern()
-    ani = FuncAnimation(plt.gcf(),
-                        func=animate_pattern,
-                        fargs=[anim_data,ax,settings],
-                        frames=len(anim_data[0]),
-                        init_func=partial(init_pattern,plot_data,settings),
+    # preallocate the artists, then let FuncAnimation blit only the parts that move
+    pattern = PatternAnimation(plot_data,settings,ax)
+    ani = FuncAnimation(ax.figure,
+                        func=pattern.update,
+                        frames=len(pattern.x_anim),
+                        init_func=pattern.init,
                         interval=25,
+                        blit=True,
                         repeat=True)
     return ani
 
+def frame_geometry(plot_data,size):
+    # pixels per unit and the pattern's center, matching the 4x4 window hex_draw shows animations in:
+    # matplotlib's 5% autoscale margins, then pad_axes' extra twentieth, then centered with equal aspect
+    x_vals,y_vals = plot_data[:2]
+    x_range = (max(x_vals)-min(x_vals))*1.1
+    y_range = (max(y_vals)-min(y_vals))*1.1
+    pad = min(x_range,y_range)/20
+    per_unit = size/(max(x_range,y_range)+2*pad)
+    return per_unit,(max(x_vals)+min(x_vals))/2,(max(y_vals)+min(y_vals))/2
+
+def render_frames(plot_data,settings,size=400,supersample=2):
+    # draws each animation frame straight into a Pillow image, without going through matplotlib
+    # the finished part of the line only ever grows, so it's drawn onto one canvas a piece at a time,
+    # and each frame is that canvas plus the cursor, shrunk down for antialiasing and mapped onto a shared palette
+    # yields (part,box) pairs, where box is the region that changed since the last frame and part is just that region,
+    # so only the changed region ever gets shrunk and mapped - the first frame's box is the whole frame
+    x_vals,y_vals,scale = plot_data[:3]
+    colors = settings["animated_colors"]
+    speed = 51-settings["anim_speed"]
+    x_anim,y_anim = anim_interpolate(plot_data,speed)[:2]
+    full = size*supersample
+    per_unit,x_mid,y_mid = frame_geometry(plot_data,full)
+    per_point = full/4/72
+    pixels = [(full/2+(x_anim[i]-x_mid)*per_unit,full/2-(y_anim[i]-y_mid)*per_unit) for i in range(1,len(x_anim))]
+    pixels.insert(0,None)
+    vertices = pixels[1::speed]
+
+    line_width = max(1,round(scale*per_point))
+    dot_radius = (2*scale+1)*per_point/2
+    point_radius = 2.2*scale*per_point/2
+    point_edge = max(1,round(0.4*scale*per_point))
+    cursor_radius = 2.9*scale*per_point/2
+    cursor_edge = max(1,round(0.5*scale*per_point))
+
+    def segment(draw,start,end,color):
+        draw.line((start,end),fill=color,width=line_width)
+        for x,y in (start,end):
+            draw.ellipse((x-line_width/2,y-line_width/2,x+line_width/2,y+line_width/2),fill=color)
+
+    def circle(draw,center,radius,color,edge_color=None,edge=0):
+        x,y = center
+        draw.ellipse((x-radius,y-radius,x+radius,y+radius),fill=color,outline=edge_color,width=edge)
+
+    def cursor(draw,center):
+        draw.regular_polygon((center,cursor_radius),6,rotation=30,fill=colors[2],outline=colors[3],width=cursor_edge)
+
+    def region(*centers):
+        # bounding box in output pixels around some points, with room for the biggest marker
+        reach = cursor_radius+cursor_edge+2*supersample
+        xs = [center[0] for center in centers]
+        ys = [center[1] for center in centers]
+        return (max(0,int((min(xs)-reach)/supersample)),max(0,int((min(ys)-reach)/supersample)),
+                min(size,int((max(xs)+reach)/supersample)+1),min(size,int((max(ys)+reach)/supersample)+1))
+
+    # the full pattern in the background
+    canvas = Image.new("RGB",(full,full),"white")
+    draw = ImageDraw.Draw(canvas)
+    for i in range(len(vertices)-1):
+        segment(draw,vertices[i],vertices[i+1],colors[0])
+    for vertex in vertices:
+        circle(draw,vertex,dot_radius,"black")
+
+    # one palette for every frame, taken from what the first and last frames will look like
+    finished = canvas.copy()
+    finished_draw = ImageDraw.Draw(finished)
+    for i in range(len(vertices)-1):
+        segment(finished_draw,vertices[i],vertices[i+1],colors[1])
+    for vertex in vertices:
+        circle(finished_draw,vertex,point_radius,colors[1],"black",point_edge)
+    circle(finished_draw,vertices[0],point_radius,"#ff6bff","black",point_edge)
+    cursor(finished_draw,vertices[-1])
+    both = Image.new("RGB",(canvas.width*2,canvas.height))
+    both.paste(canvas,(0,0))
+    both.paste(finished,(canvas.width,0))
+    palette = both.reduce(supersample).quantize(colors=64)
+
+    for f in range(len(pixels)):
+        if f == 0:
+            part = canvas.copy()
+            circle(ImageDraw.Draw(part),pixels[1],point_radius,"#ff6bff","black",point_edge)
+            box = (0,0,size,size)
+        else:
+            if f > 1: segment(draw,pixels[f-1],pixels[f],colors[1])
+            # keep the most recent point on top of the line leaving it
+            reached = vertices[(f-1)//speed]
+            circle(draw,reached,point_radius,colors[1],"black",point_edge)
+            box = region(pixels[f-1] or pixels[1],pixels[f],reached)
+            # the cursor is drawn onto a copy of just the changed region, shifted to match
+            part = canvas.crop(tuple(edge*supersample for edge in box))
+            x,y = pixels[f]
+            cursor(ImageDraw.Draw(part),(x-box[0]*supersample,y-box[1]*supersample))
+        yield part.reduce(supersample).quantize(palette=palette,dither=Image.Dither.NONE),box
+
+def write_gif(frames,filename,duration):
+    # writes each frame as soon as it's made, and only the part of it that changed
+    with open(filename,mode="wb") as file:
+        for i,(part,box) in enumerate(frames):
+            if i == 0:
+                header = GifImagePlugin.getheader(part,info={"loop":0,"duration":duration,"optimize":False})[0]
+                file.write(b"".join(header))
+            file.write(b"".join(GifImagePlugin.getdata(part,offset=box[:2],duration=duration,disposal=1)))
+        file.write(b";")
+
+def png_chunk(kind,data):
+    return struct.pack(">I",len(data))+kind+data+struct.pack(">I",zlib.crc32(kind+data))
+
+def write_apng(frames,filename,duration,count):
+    # animated PNG, written a frame at a time - only the changed region of each frame is stored
+    sequence = 0
+    with open(filename,mode="wb") as file:
+        for part,box in frames:
+            if sequence == 0:
+                file.write(b"\x89PNG\r\n\x1a\n")
+                file.write(png_chunk(b"IHDR",struct.pack(">IIBBBBB",part.size[0],part.size[1],8,3,0,0,0)))
+                file.write(png_chunk(b"acTL",struct.pack(">II",count,0)))
+                file.write(png_chunk(b"PLTE",bytes(part.getpalette()[:768])))
+            width,height = part.size
+            rows = part.tobytes()
+            data = zlib.compress(b"".join(b"\0"+rows[i*width:(i+1)*width] for i in range(height)))
+            file.write(png_chunk(b"fcTL",struct.pack(">IIIIIHHBB",sequence,width,height,box[0],box[1],duration,1000,0,0)))
+            sequence += 1
+            if sequence == 1:
+                file.write(png_chunk(b"IDAT",data))
+            else:
+                file.write(png_chunk(b"fdAT",struct.pack(">I",sequence)+data))
+                sequence += 1
+        file.write(png_chunk(b"IEND",b""))
+
+def save_animation(plot_data,settings,filename):
+    # renders an animated pattern to a .gif, .png (APNG) or .webp file without using matplotlib
+    frames = render_frames(plot_data,settings)
+    duration = 25
+    if filename.endswith(".gif"):
+        write_gif(frames,filename,duration)
+    elif filename.endswith(".png"):
+        count = len(anim_interpolate(plot_data,51-settings["anim_speed"])[0])
+        write_apng(frames,filename,duration,count)
+    else:
+        # Pillow's WebP encoder wants every frame up front, so each changed part is pasted onto a copy of the frame before it,
+        # and they're kept in palette mode to keep them small
+        images = [next(frames)[0]]
+        for part,box in frames:
+            images.append(images[-1].copy())
+            images[-1].paste(part,box[:2])
+        images[0].save(filename,save_all=True,append_images=images[1:],duration=duration,loop=0,lossless=True)
+
 if __name__ == "__main__":
     with open("settings.json",mode="r") as file:
         settings = json.load(file)
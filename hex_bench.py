@@ -0,0 +1,213 @@
+# benchmarks for the parsing, identifying and drawing hot paths
+# run with "python hex_bench.py", or "python hex_bench.py --help" for saving and comparing baselines
+from contextlib import redirect_stdout
+from fractions import Fraction
+from itertools import product
+from os import chdir
+from os import devnull
+from os import environ
+from os import path
+import argparse
+import json
+import platform
+import random
+import statistics
+import tempfile
+import sys
+import time
+import tracemalloc
+
+# everything is drawn off screen, and never through the render cache, so runs are repeatable
+environ["MPLBACKEND"] = "Agg"
+chdir(path.dirname(path.abspath(__file__)))
+import hex_draw
+
+def random_pattern(length,seed):
+    # a random pattern that doesn't overlap itself, built a turn at a time
+    rng = random.Random(seed)
+    angle_sig = ""
+    while len(angle_sig) < length:
+        for char in rng.sample("qweqwead",8):
+            if hex_draw.lattice_walk(angle_sig+char,"east")[1] == "ok":
+                angle_sig += char
+                break
+        else:
+            break
+    return angle_sig
+
+def nested_spell(depth):
+    # a spell with a list inside a list inside a list, depth times over
+    spell = "HexPattern(EAST qaq)"
+    for i in range(depth):
+        spell = "[HexPattern(EAST aqaaw), "+spell+", HexPattern(WEST qqqaw)]"
+    return spell
+
+def build_workloads(registry):
+    # synthetic inputs, the same on every run
+    short = "qaq"
+    long = random_pattern(300,1)
+    # a large registry of made-up names and patterns, for lookups that scale with the registry
+    # they're only looked up, never drawn, so they don't need to be valid patterns
+    rng = random.Random(2)
+    names = dict(registry[2] or {})
+    patterns = dict(registry[0] or {})
+    for i in range(20000):
+        angle_sig = "".join(rng.choices("qweadw",k=12))
+        names["Synthetic Pattern "+str(i)] = (None,angle_sig,"east",False)
+        patterns.setdefault(angle_sig,"Synthetic Pattern "+str(i))
+    flat = "["+", ".join(["HexPattern(EAST qaq)","HexPattern(WEST qqqaw)","HexPattern(EAST aqaaw)",
+                          "HexPattern(NORTH_EAST qeewdweddw)","Mind's Reflection","(1, 2, 3)"]*100)+"]"
+    # 41 patterns, which with the brackets round them are 43 iotas, exactly one page of the default grid
+    grid = "["+", ".join((["HexPattern(EAST qaq)","HexPattern(EAST aqaaw)","HexPattern(NORTH_EAST qeewdweddw)",
+                           "HexPattern(EAST "+long[:40]+")"]*11)[:41])+"]"
+    numbers = ["42","-17","1000","2.5","-0.75","3/8","-3/8","0.125","13/8","1/16"]
+    return {"short":short,"long":long,"names":names,"patterns":patterns,"flat":flat,"nested":nested_spell(50),"grid":grid,"numbers":numbers}
+
+def build_cases(registry,settings,work,folder):
+    # each case is a name and a function to time, set up so the function does nothing else
+    # images are drawn into folder, and overwritten every time
+    image = path.join(folder,"bench.png")
+    list_settings = dict(settings,list_mode=True)
+    large_registry = [work["patterns"],registry[1],work["names"],True,hex_draw.build_name_index(work["names"])]
+    short_data = hex_draw.convert_to_points(work["short"],"east",settings)
+    long_data = hex_draw.convert_to_points(work["long"],"east",settings)
+    grid_spell = hex_draw.string_to_spell(work["grid"],registry,list_settings)
+    assert len(grid_spell) == settings["grid_dims"][2], "the grid workload should fill exactly one page"
+    flat_spell = hex_draw.string_to_spell(work["flat"],registry,list_settings)
+    quiet_settings = dict(list_settings,draw_mode="disabled")
+    # every encoded number has to read back as itself, including eighths and smaller, which can't put all their halvings at the end
+    for value in work["numbers"]+["-5/32","-1/64","1/1024"]:
+        angle_sig,start_dir = hex_draw.encode_number(value)
+        name = hex_draw.parse_number(angle_sig)
+        assert hex_draw.lattice_walk(angle_sig,start_dir)[1] == "ok", value+" was encoded as "+angle_sig+", which overlaps itself"
+        assert Fraction(name[name.index("(")+1:-1]) == Fraction(value), value+" was encoded as "+angle_sig+", which reads as "+name
+    # and every Bookkeeper's Gambit mask up to 8 long has to read back as itself
+    for mask in ("".join(chars) for length in range(1,9) for chars in product("-v",repeat=length)):
+        angle_sig,start_dir = hex_draw.encode_bookkeeper(mask)
+        assert hex_draw.lattice_walk(angle_sig,start_dir)[1] == "ok", mask+" was encoded as "+angle_sig+", which overlaps itself"
+        assert hex_draw.decode_bookkeeper(angle_sig) == mask, mask+" was encoded as "+angle_sig+", which reads as "+str(hex_draw.decode_bookkeeper(angle_sig))
+
+    def draw(shapes):
+        ax = hex_draw.new_pattern_axes(4)
+        hex_draw.draw_shapes(shapes)
+        ax.figure.savefig(image)
+        hex_draw.plt.close(ax.figure)
+
+    def spell_list(spell):
+        fig = hex_draw.plot_spell_list(spell,list_settings)
+        fig.savefig(image)
+        hex_draw.plt.close(fig)
+
+    def translate(spell):
+        hex_draw.parse_spell_list(spell,registry,quiet_settings)
+
+    def encode(values):
+        hex_draw.encode_number.cache_clear()
+        hex_draw.encode_numbers(values)
+
+    return [("convert_to_points/short",lambda: hex_draw.convert_to_points(work["short"],"east",settings)),
+            ("convert_to_points/long",lambda: hex_draw.convert_to_points(work["long"],"east",settings)),
+            ("convert_to_points/overlapping",lambda: hex_draw.convert_to_points("qqqqqq"*50,"east",settings)),
+            ("convert_to_points/number",lambda: hex_draw.convert_to_points("aqaa"+"w"*2000,"east",settings)),
+            ("dict_lookup/large",lambda: hex_draw.dict_lookup(work["long"],large_registry[0])),
+            ("gs_lookup/short",lambda: hex_draw.gs_lookup(short_data[4],registry[1])),
+            ("gs_lookup/long",lambda: hex_draw.gs_lookup(long_data[4],registry[1])),
+            ("build_name_index/large",lambda: hex_draw.build_name_index(work["names"])),
+            ("format_pattern/hexpattern",lambda: hex_draw.format_pattern("HexPattern(EAST "+work["long"]+")",large_registry,settings)),
+            ("format_pattern/name",lambda: hex_draw.format_pattern("mind's refl",large_registry,settings)),
+            ("format_pattern/partial_name",lambda: hex_draw.format_pattern("pattern 4999",large_registry,settings)),
+            ("string_to_spell/flat",lambda: hex_draw.string_to_spell(work["flat"],registry,list_settings)),
+            ("string_to_spell/nested",lambda: hex_draw.string_to_spell(work["nested"],registry,list_settings)),
+            ("parse_spell_list/flat",lambda: translate(flat_spell)),
+            ("identify_spell/flat",lambda: list(hex_draw.identify_spell(flat_spell,registry,list_settings))),
+            ("intersect_shapes/long",lambda: hex_draw.intersect_shapes(long_data,settings)),
+            ("draw/monochrome",lambda: draw(hex_draw.monochrome_shapes(long_data,settings))),
+            ("draw/intersect",lambda: draw(hex_draw.intersect_shapes(long_data,settings))),
+            ("draw/gradient",lambda: draw(hex_draw.gradient_shapes(long_data,settings))),
+            ("pattern_svg/long",lambda: hex_draw.pattern_svg(long_data,False,settings)),
+            ("pattern_png/long",lambda: hex_draw.pattern_png(long_data,False,settings,image)),
+            ("plot_spell_list/grid",lambda: spell_list(grid_spell)),
+            ("encode_numbers/mixed",lambda: encode(work["numbers"]))]
+
+def time_case(function,repeat,budget):
+    # runs the function enough times per repeat to fill the time budget, and returns seconds per call for each repeat
+    # anything the function prints is thrown away
+    with open(devnull,mode="w") as null, redirect_stdout(null):
+        return timed_runs(function,repeat,budget),peak_memory(function)
+
+def timed_runs(function,repeat,budget):
+    function()
+    number = 1
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter()-start
+    if elapsed < budget: number = max(1,int(budget/max(elapsed,1e-7)))
+    results = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(number): function()
+        results.append((time.perf_counter()-start)/number)
+    return results
+
+def peak_memory(function):
+    # the most memory allocated at once during a single call, in kilobytes
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak/1024
+
+def format_time(seconds):
+    for unit,scale in (("s",1),("ms",1e-3),("µs",1e-6)):
+        if seconds >= scale: return format(seconds/scale,".3g")+" "+unit
+    return format(seconds/1e-9,".3g")+" ns"
+
+def run_bench(args,folder):
+    registry = hex_draw.load_registry()
+    settings = dict(hex_draw.default_settings,render_cache="off")
+    hex_draw.load_pyplot()
+
+    print("Building workloads...",file=sys.stderr)
+    cases = build_cases(registry,settings,build_workloads(registry),folder)
+    cases = [case for case in cases if not args.filter or any(part in case[0] for part in args.filter)]
+
+    results = {}
+    for name,function in cases:
+        times,peak = time_case(function,args.repeat,args.budget)
+        results[name] = {"median":statistics.median(times),"min":min(times),"peak_kb":round(peak,1)}
+        print(name.ljust(32)+format_time(results[name]["median"]).rjust(10)+(format(results[name]["peak_kb"],".0f")+" KB").rjust(12))
+        sys.stdout.flush()
+    return results
+
+def compare(results,baseline,threshold):
+    # prints how each case changed, returning the names of any that got slower than the threshold allows
+    print("\n"+"case".ljust(32)+"baseline".rjust(10)+"now".rjust(10)+"change".rjust(10))
+    slower = []
+    for name,result in results.items():
+        if name not in baseline["results"]: continue
+        ratio = result["median"]/baseline["results"][name]["median"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  SLOWER"
+            slower.append(name)
+        elif ratio < 1/threshold: flag = "  faster"
+        print(name.ljust(32)+format_time(baseline["results"][name]["median"]).rjust(10)+format_time(result["median"]).rjust(10)+(format(ratio,".2f")+"×").rjust(10)+flag)
+    return slower
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="hex_bench.py",description="Benchmarks for hex_draw.py.")
+    parser.add_argument("filter",nargs="*",help="only run cases whose names contain one of these")
+    parser.add_argument("--repeat",type=int,default=5,help="number of timed repeats per case (default: 5)")
+    parser.add_argument("--budget",type=float,default=0.2,help="roughly how many seconds each repeat should take (default: 0.2)")
+    parser.add_argument("--save",help="save the results as a baseline JSON file")
+    parser.add_argument("--compare",help="compare the results against a saved baseline")
+    parser.add_argument("--threshold",type=float,default=1.25,help="how many times slower a case can get before it counts as a regression (default: 1.25)")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as folder:
+        results = run_bench(args,folder)
+    if args.save:
+        with open(args.save,mode="w") as file:
+            json.dump({"python":platform.python_version(),"platform":platform.platform(),"results":results},file,indent=2)
+    if args.compare:
+        with open(args.compare,mode="r") as file: baseline = json.load(file)
+        if compare(results,baseline,args.threshold): sys.exit(1)
@@ -1,92 +1,173 @@
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-from matplotlib.animation import PillowWriter
-from matplotlib import colormaps
-from matplotlib import colors
+from collections import OrderedDict
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from contextlib import nullcontext
+from fractions import Fraction
+from functools import lru_cache
+from hashlib import sha256
+from itertools import chain
 from os import chdir
+from os import cpu_count
+from os import environ
+from os import getpid
+from os import makedirs
 from os import path
+from os import remove
+from os import replace
+from os import scandir
+from os import utime
+from shutil import copyfile
+import argparse
 import pickle
 import json
 import math
+import mmap
+import re
+import sqlite3
+import sys
+import time
+
+# matplotlib takes longer to import than most spells take to identify,
+# so it's only loaded once something actually needs to be drawn
+plt = None
+colormaps = None
+LineCollection = None
+PathCollection = None
+MarkerStyle = None
+IdentityTransform = None
+
+def load_pyplot():
+    global plt,colormaps,LineCollection,PathCollection,MarkerStyle,IdentityTransform
+    if plt is None:
+        import matplotlib.pyplot as plt
+        from matplotlib import colormaps
+        from matplotlib.collections import LineCollection
+        from matplotlib.collections import PathCollection
+        from matplotlib.markers import MarkerStyle
+        from matplotlib.transforms import IdentityTransform
+
+# per-stage timings for the prompt, switched on by setting "timing" to "json" or "trace"
+# spans holds a (stage,start,duration) for every stage timed for the current input, and files is the timing files
+# already started this session
+timing = {"on":False,"spans":[],"files":set()}
+no_timing = nullcontext()
+
+def timed(stage):
+    # use as "with timed(stage):" around anything worth timing - it does nothing while timing is off
+    return timed_span(stage) if timing["on"] else no_timing
+
+@contextmanager
+def timed_span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing["spans"].append((stage,start,time.perf_counter()-start))
+
+@contextmanager
+def timed_request(raw_input,settings):
+    # times everything done for one input, then prints where the time went and adds it to the session's timings
+    # stages can be inside one another (geometry happens during layout, for instance), so they don't always add up to the total
+    timing["on"] = settings["timing"] in ("json","trace")
+    first = len(timing["spans"])
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timing["on"]:
+            stages = {}
+            for stage,span_start,duration in timing["spans"][first:]:
+                stages[stage] = stages.get(stage,0)+duration
+            request = {"input":raw_input,"start":start,"total":time.perf_counter()-start,"stages":stages}
+            print("Timing: "+", ".join(stage+" "+format(seconds*1000,".3g")+"ms" for stage,seconds in stages.items())
+                  +(", " if stages else "")+"total "+format(request["total"]*1000,".3g")+"ms")
+            save_timings(settings["timing"],request,timing["spans"][first:])
+        del timing["spans"][first:]
+
+def save_timings(timing_format,request,spans):
+    # adds one input's timings to the end of the file, so nothing already saved is written again
+    # each file is started afresh the first time it's used in a session
+    # json is JSON Lines, with the totals for one input on each line
+    # trace is every span in Chrome's JSON array format for chrome://tracing or Perfetto, which allows the closing bracket
+    # to be left off, so the file can be opened at any point
+    filename = "timings.trace.json" if timing_format == "trace" else "timings.jsonl"
+    started = filename in timing["files"]
+    timing["files"].add(filename)
+    with open(filename,mode="a" if started else "w") as file:
+        if timing_format == "trace":
+            events = [{"name":request["input"][:60],"cat":"request","ph":"X","ts":request["start"]*1e6,"dur":request["total"]*1e6,"pid":1,"tid":1}]
+            events += [{"name":stage,"cat":"stage","ph":"X","ts":start*1e6,"dur":duration*1e6,"pid":1,"tid":1}
+                       for stage,start,duration in spans]
+            file.write(("" if started else "[\n")+"".join(json.dumps(event)+",\n" for event in events))
+        else:
+            file.write(json.dumps({name:request[name] for name in ("input","total","stages")})+"\n")
+
+def profile_input(raw_input,registry,settings):
+    # runs one input under cProfile, printing the slowest calls and saving the full profile for other tools
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.runcall(handle_input,raw_input,registry,settings)
+    profiler.dump_stats("profile.prof")
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+    print("Full profile saved to profile.prof.\n-----")
+
+# unit steps on the axial hex lattice, counterclockwise from east
+lattice_dirs = [(1,0),(0,1),(-1,1),(-1,0),(0,-1),(1,-1)]
+start_dirs = {"east":0,"northeast":1,"northwest":2,"west":3,"southwest":-2,"southeast":-1}
+turns = {"a":2,"q":1,"w":0,"e":-1,"d":-2}
+sqrt3_2 = math.sqrt(3)/2
+
+def lattice_walk(angle_sig,start_dir):
+    # walk the pattern on the integer lattice, hashing each edge as it's drawn
+    # returns the list of vertices and either "ok", "overlap" or "invalid"
+    direction = start_dirs[start_dir]
+    q,r = lattice_dirs[direction%6]
+    points = [(0,0),(q,r)]
+    edges = {((0,0),(q,r)) if (0,0)<(q,r) else ((q,r),(0,0))}
+    status = "ok"
+    for char in angle_sig:
+        if char not in turns:
+            return (points,"invalid")
+        direction += turns[char]
+        step = lattice_dirs[direction%6]
+        q += step[0]
+        r += step[1]
+        # edges are stored with their endpoints sorted, so a retrace in either direction collides
+        edge = (points[-1],(q,r)) if points[-1]<(q,r) else ((q,r),points[-1])
+        if edge in edges: status = "overlap"
+        else: edges.add(edge)
+        points.append((q,r))
+    return (points,status)
+
+def to_lattice(x_vals,y_vals):
+    # snap cartesian points back onto the lattice they came from
+    # only needed for great spells saved by older versions, which stored cartesian pointlists
+    # flooring rather than rounding keeps every point consistent even if the list was shifted by half a step
+    points = []
+    for i in range(len(x_vals)):
+        r = round(y_vals[i]/sqrt3_2)
+        points.append((math.floor(x_vals[i]-r/2+0.25),r))
+    return points
 
 def convert_to_points(angle_sig,start_dir,settings):
-    unit = math.pi/3
-
-    # define the first two points and the starting angle based on start_dir
-    match start_dir:
-        case "east":
-            x=1
-            y=0
-            angle = 0
-        case "west":
-            x=-1
-            y=0
-            angle = math.pi
-        case "northeast":
-            x=0.5
-            y=0.866
-            angle = unit
-        case "northwest":
-            x=-0.5
-            y=0.866
-            angle = 2*unit
-        case "southeast":
-            x=0.5
-            y=-0.866
-            angle = -unit
-        case "southwest":
-            x=-0.5
-            y=-0.866
-            angle = -2*unit
-        case _:
-            print("Invalid start direction '"+start_dir+"' - defaulted to east")
-            x=1
-            y=0
-            angle = 0
-
-    # initialize the x and y lists with the first two points
-    x_vals = [0,x]
-    y_vals = [0,y]
+    if start_dir not in start_dirs:
+        print("Invalid start direction '"+start_dir+"' - defaulted to east",file=sys.stderr)
+        start_dir = "east"
 
     # calculate the start angle in degrees, for later use
-    start_angle = round((angle*180/math.pi)-90,0)
-
-    # parse the angle signature, one character at a time
-    for char in angle_sig:
-        match char:
-            case 'a':
-                angle += 2*unit
-            case 'q':
-                angle += unit
-            case 'w':
-                pass
-            case 'e':
-                angle -= unit
-            case 'd':
-                angle -= 2*unit
-            case _:
-                return (x_vals,None,0,start_angle)
-        # convert from polar to cartesian coordinates
-        # then add the new point to the x and y lists
-        x += math.cos(angle)
-        y += math.sin(angle)
-        x_vals.append(x)
-        y_vals.append(y)
-
-    # check if pattern overlaps itself
-    checked = []
-    for i in range(len(x_vals)-1):
-        for j in range(len(checked)-1):
-            if (abs(x_vals[i]-checked[j][0]) < 0.1 and     # overlap in same direction
-                abs(y_vals[i]-checked[j][1]) < 0.1 and
-                abs(x_vals[i+1]-checked[j+1][0]) < 0.1 and
-                abs(y_vals[i+1]-checked[j+1][1]) < 0.1 or
-                abs(x_vals[i]-checked[j+1][0]) < 0.1 and   # overlap in opposite direction
-                abs(y_vals[i]-checked[j+1][1]) < 0.1 and
-                abs(x_vals[i+1]-checked[j][0]) < 0.1 and
-                abs(y_vals[i+1]-checked[j][1]) < 0.1):
-                return (None,y_vals,0,start_angle)
-        checked.append((x_vals[i],y_vals[i]))
+    start_angle = 60*start_dirs[start_dir]-90
+
+    # trace the pattern on the lattice, then convert to cartesian coordinates for drawing
+    # the lattice points are passed along too, for anything that needs exact positions
+    points,status = lattice_walk(angle_sig,start_dir)
+    x_vals = [q+r/2 for q,r in points]
+    y_vals = [r*sqrt3_2 for q,r in points]
+    if status == "invalid":
+        return (x_vals,None,0,start_angle,points)
+    elif status == "overlap":
+        return (None,y_vals,0,start_angle,points)
 
     # find the width or height, whichever is largest, and apply some transformations to it
     # this value is used when drawing to scale the lines and points based on graph size
@@ -99,7 +180,7 @@ def convert_to_points(angle_sig,start_dir,settings):
         scale *= 0.8
         scale = min((scale,2.5))
    
-    return (x_vals,y_vals,scale,start_angle)
+    return (x_vals,y_vals,scale,start_angle,points)
 
 def parse_number(angle_sig):
     output = 0
@@ -116,39 +197,258 @@ def parse_number(angle_sig):
             case 'd':
                 output /= 2
             case _:
-                print("Invalid char - skipped")
+                # not a pattern that could be drawn, so not a number either
+                return None
     if angle_sig[:4]=="dedd":
         output *= -1
     return "Numerical Reflection ("+str(output)+")"
 
-def parse_bookkeeper(angle_sig):
-    if not angle_sig: return "Bookkeeper's Gambit (-)"
-    if angle_sig[0]=="a":
-        output = "v"
-        skip = True
-    elif angle_sig.startswith(("e","w")):
-        output = "-"
-        skip = False
+# the reverse of parse_number - finding the shortest Numerical Reflection that makes a given number
+# w, q and e add 1, 5 and 10, a doubles and d halves, so a signature is runs of additions with a doubling or halving between each
+# the plan works back from the target to every state the pattern could be in just after a run, and how many steps
+# each one still needs, then the search walks forward along the plan a step at a time, dropping any step that overlaps
+
+def addition_cost(value):
+    # fewest additions that add up to value
+    return value//10+value%10//5+value%5
+
+def run_chars(value):
+    return "e"*(value//10)+"q"*(value%10//5)+"w"*(value%5)
+
+def next_tail(tail,separator,run):
+    # how many doublings (positive) or halvings (negative) the signature ends with after separator and run
+    if run: return 0
+    step = 1 if separator == "a" else -1
+    return tail+step if tail*step > 0 else step
+
+def number_moves(plan,w,halved,target,halvings):
+    # every doubling or halving and run that can follow a state and still be in the plan,
+    # as (separator,run,w,halved) for the state it leads to
+    # a run of 40 or more is never worth trying, since adding half as much before the doubling or halving does the same in fewer steps
+    moves = []
+    for run in range(40):
+        if w+run*2**halved > target: break
+        for separator,new_w,new_halved in (("a",w*2+run*2**halved,halved),("d",w+run*2**(halved+1),halved+1)):
+            if new_halved > halvings or (new_w,new_halved) == (w,halved) or (new_w,new_halved,0) not in plan: continue
+            moves.append((separator,run,new_w,new_halved))
+    return moves
+
+def number_plan(target,halvings,deadline=math.inf):
+    # returns a dict of (w,halved,tail) to the fewest steps needed to reach target after halvings halvings, for every state
+    # the pattern could be in just after a run, or None if it isn't done by deadline
+    # w is the value so far times 2 to the power of halved, the number of halvings so far, which keeps every value a whole number:
+    # a doubling doubles w, and a halving leaves w alone but doubles what each addition after it adds
+    # tail is from next_tail - three doublings or three halvings in a row always overlap (they walk round a triangle),
+    # so that's the one overlap the plan knows about
+    states = {(target,halvings)}
+    level = {(target,halvings)}
+    while level:
+        new = set()
+        for w,halved in level:
+            for run in range(40):
+                rest = w-run*2**halved
+                if rest < 0: break
+                if rest%2 == 0 and rest//2 != w: new.add((rest//2,halved))
+                if halved > 0: new.add((rest,halved-1))
+        level = new-states
+        states |= level
+
+    # every step makes w bigger or adds a halving, so working down from the target means the states after each one are already done
+    # any move with a run leaves the tail at 0, so only the bare doubling and halving depend on the tail, and the rest
+    # are only looked at once per state
+    plan = {(target,halvings,tail):0 for tail in range(-2,3)}
+    for w,halved in sorted(states,reverse=True)[1:]:
+        if time.perf_counter() > deadline: return None
+        best = math.inf
+        bare = []
+        for separator,run,new_w,new_halved in number_moves(plan,w,halved,target,halvings):
+            if run: best = min(best,1+addition_cost(run)+plan[(new_w,new_halved,0)])
+            else: bare.append((separator,new_w,new_halved))
+        for tail in range(-2,3):
+            plan[(w,halved,tail)] = min([best]+[1+plan[(new_w,new_halved,after)] for separator,new_w,new_halved in bare
+                                                if abs(after := next_tail(tail,separator,0)) < 3])
+    return plan
+
+def number_search(search,angle_sig,point,direction,state,run,steps):
+    # depth-first search for a signature that finishes run and then reaches the target in at most steps more steps
+    # point and direction are where angle_sig has got to, state is the (w,halved,tail) it'll be in once run is done,
+    # and search holds the plan, the target, the edges drawn so far, the moves from each state, the step limit
+    # and the time to give up by
+    # the cheapest moves are tried first
+    plan = search["plan"]
+    w,halved,tail = state
+    if run:
+        options = [(char,state,run.replace(char,"",1)) for char in sorted(set(run))]
+    elif plan[state] == 0:
+        return angle_sig
     else:
-        return None
-    for char in angle_sig:
-        if(skip):
-            skip = False
-            continue
-        if(char=="w" and output[-1]=="-"):
-            output += "-"
-        elif(char=="e"):
-            if(output[-1]=="v"):
-                output += "-"
-            elif(output[-1]=="-"):
-                output += "v"
-                skip = True
-            else: return None
-        elif(char=="d"):
-            output += "v"
-            skip = True
-        else: return None
-    return "Bookkeeper's Gambit ("+output+")"
+        options = []
+        # the same states come up over and over while backtracking, so their moves are only worked out once
+        if (w,halved) not in search["moves"]:
+            search["moves"][(w,halved)] = number_moves(plan,w,halved,search["target"],search["halvings"])
+        for separator,move_run,new_w,new_halved in search["moves"][(w,halved)]:
+            after = next_tail(tail,separator,move_run)
+            if abs(after) > 2: continue
+            cost = 1+addition_cost(move_run)+plan[(new_w,new_halved,after)]
+            if cost <= steps: options.append((cost,separator,(new_w,new_halved,after),run_chars(move_run)))
+        options = [(separator,new,rest) for cost,separator,new,rest in sorted(options)]
+    for char,new,rest in options:
+        if search["limit"] == 0 or time.perf_counter() > search["deadline"]: return None
+        search["limit"] -= 1
+        # the same step and edge check as lattice_walk, one step at a time
+        turned = direction+turns[char]
+        step = lattice_dirs[turned%6]
+        end = (point[0]+step[0],point[1]+step[1])
+        edge = (point,end) if point<end else (end,point)
+        if edge in search["edges"]: continue
+        search["edges"].add(edge)
+        found = number_search(search,angle_sig+char,end,turned,new,rest,steps-1)
+        search["edges"].discard(edge)
+        if found: return found
+    return None
+
+def halving_spiral(angle_sig,start_dir,halvings):
+    # adds halvings halvings to the end of angle_sig without it overlapping itself
+    # "ad" doubles and then halves, so it leaves the number alone, and a run of them zigzags in a straight line -
+    # each extra "d" turns the zigzag a third of the way round, so the legs are made longer as they go to spiral outwards
+    # a leg is only taken if the next one could still be taken after it, which keeps the spiral from closing in on itself
+    # returns None if angle_sig ends somewhere too boxed in to start one
+    leg = 0
+    for i in range(halvings):
+        while (lattice_walk(angle_sig+"d"+"ad"*leg,start_dir)[1] != "ok" or
+               lattice_walk(angle_sig+"d"+"ad"*leg+"d"+"ad"*(leg+1),start_dir)[1] != "ok"):
+            leg += 1
+            if leg > len(angle_sig): return None
+        angle_sig += "d"+"ad"*leg
+    return angle_sig
+
+# finished patterns are kept, since the same numbers come up again and again, but only the most recent few thousand
+# so a long-running server doesn't hang on to every number it's ever been asked for
+@lru_cache(maxsize=4096)
+def encode_number(value,max_extra=20,step_limit=20000,time_limit=0.5):
+    # returns (angle_sig,start_dir) for the shortest Numerical Reflection of value that doesn't overlap itself
+    # value can be anything Fraction accepts, like 42, -2.5 or "7/4", but only halves, quarters and so on can be made exactly
+    # fractions settle for the best they've found after time_limit seconds - whole numbers have nothing to fall back on,
+    # and take a second or two at worst anyway
+    value = Fraction(value)
+    halvings = value.denominator.bit_length()-1
+    if value.denominator != 1 << halvings:
+        raise ValueError(str(value)+" can't be made exactly, since its denominator isn't a power of 2")
+    prefix,start_dir = ("aqaa","southeast") if value >= 0 else ("dedd","northeast")
+    points = lattice_walk(prefix,"east")[0]
+    direction = sum(turns[char] for char in prefix)
+    if value == 0: return (prefix,start_dir)
+
+    # small fractions can't be made with just as many halvings as their denominator needs, since "ddd" overlaps,
+    # so the same number times 2, 4 and so on is tried too, with that many extra halvings to make up for it
+    # each of those needs at least one more step than it has halvings, so it's only planned once the search gets that far
+    # past 1/32 or so (or sooner for big numerators) the shortest ones need so many extra halvings that the plans get too big,
+    # so the numerator with a halving spiral on the end is the fallback, and the search stops once it couldn't beat that
+    # if the numerator's pattern ends too boxed in, twice the numerator with one more halving is tried, and so on
+    # plans for the bigger multiples take seconds to build, so they only get the first half of the time limit,
+    # which leaves the rest for searching whichever plans are ready
+    deadline = time.perf_counter()+time_limit if halvings else math.inf
+    plan_deadline = time.perf_counter()+time_limit/2 if halvings else math.inf
+    spiral = None
+    for extra in range(8 if halvings else 0):
+        if spiral := halving_spiral(encode_number(value.numerator << extra)[0],start_dir,halvings+extra): break
+    plans = []
+    more_plans = True
+    angle_sig = None
+    steps = 0
+    while not angle_sig:
+        steps += 1
+        while (more_plans and len(plans) <= min(2*halvings,8) and halvings+len(plans)+1 <= steps and
+               (not plans or abs(value.numerator) << len(plans) <= 4096)):
+            target = abs(value.numerator) << len(plans)
+            plan = number_plan(target,halvings+len(plans),plan_deadline)
+            if plan is None:
+                more_plans = False
+                break
+            # the first run comes straight after the prefix, with no doubling or halving before it
+            first = sorted((addition_cost(w)+plan[(w,0,0)],w) for w,halved,after in plan if w > 0 and halved == 0 and after == 0)
+            plans.append((plan,target,halvings+len(plans),first,{}))
+        lowest = min((plan[3][0][0] for plan in plans if plan[3]),default=math.inf)
+        if spiral and (steps >= len(spiral)-4 or time.perf_counter() > deadline):
+            angle_sig = spiral
+            break
+        if steps > lowest+max_extra or (lowest == math.inf and (len(plans) > min(2*halvings,8) or not more_plans)):
+            if spiral:
+                angle_sig = spiral
+                break
+            raise ValueError("couldn't find a Numerical Reflection for "+str(value)+" that doesn't overlap itself")
+
+        # look for the shortest signature first, allowing an extra step at a time if every one of them overlaps
+        # each length only gets step_limit steps of searching between all the plans, so past a few million this can settle
+        # for one a little longer than the shortest
+        limit = step_limit
+        for plan,target,total_halvings,first,moves in plans:
+            search = {"plan":plan,"target":target,"halvings":total_halvings,"limit":limit,"moves":moves,"deadline":deadline,
+                      "edges":{(a,b) if a<b else (b,a) for a,b in zip(points,points[1:])}}
+            for cost,w in first:
+                if cost > steps: break
+                if angle_sig := number_search(search,prefix,points[-1],direction,(w,0,0),run_chars(w),steps): break
+            if angle_sig: break
+            limit = search["limit"]
+    return (angle_sig,start_dir)
+
+def hexpattern_string(angle_sig,start_dir):
+    # the HexPattern(...) form the mod uses, like HexPattern(SOUTH_EAST aqaa)
+    direction = start_dir.upper()
+    if len(direction) > 5: direction = direction[:5]+"_"+direction[5:]
+    return "HexPattern("+direction+" "+angle_sig+")"
+
+def encode_numbers(values):
+    # batch version of encode_number, returning a dict of value to (angle_sig,start_dir), or the error for values that can't be made
+    results = {}
+    for value in values:
+        try: results[value] = encode_number(value)
+        except ValueError as error: results[value] = error
+    return results
+
+# Bookkeeper's Gambit masks, where - keeps an iota and v removes one
+# each pair of mask chars adds the same signature chars wherever it is, so encoding looks up each pair in turn,
+# and decoding runs the same table backwards as a little state machine, built once at startup
+bookkeeper_starts = {"-":("","east"),"v":("a","southeast")}
+bookkeeper_steps = {("-","-"):"w",("v","-"):"e",("-","v"):"ea",("v","v"):"da"}
+
+def compile_bookkeeper(steps):
+    # returns a dict of (state,char) to (next state,mask chars added), where a state is the last mask char
+    # plus any signature chars read since then that haven't finished a step yet
+    table = {}
+    for (last,mask_char),chars in steps.items():
+        for i in range(len(chars)-1):
+            table[(last+chars[:i],chars[i])] = (last+chars[:i+1],"")
+        table[(last+chars[:-1],chars[-1])] = (mask_char,mask_char)
+    return table
+
+bookkeeper_table = compile_bookkeeper(bookkeeper_steps)
+
+# masks and signatures already worked out are kept, since the same few masks come up again and again
+@lru_cache(maxsize=1024)
+def decode_bookkeeper(angle_sig):
+    # returns the mask for a Bookkeeper's Gambit signature, or None as soon as it turns out not to be one
+    state = "v" if angle_sig.startswith(bookkeeper_starts["v"][0]) else "-"
+    mask = [state]
+    for char in angle_sig[len(bookkeeper_starts[state][0]):]:
+        if (state,char) not in bookkeeper_table: return None
+        state,mask_chars = bookkeeper_table[(state,char)]
+        mask.append(mask_chars)
+    # stopping halfway through a step (like "-e" without its "a") isn't a mask either
+    if len(state) > 1: return None
+    return "".join(mask)
+
+@lru_cache(maxsize=1024)
+def encode_bookkeeper(mask):
+    # returns (angle_sig,start_dir) for a mask, or None if it isn't one
+    if not mask or mask.strip("v-"): return None
+    angle_sig,start_dir = bookkeeper_starts[mask[0]]
+    angle_sig += "".join(bookkeeper_steps[pair] for pair in zip(mask,mask[1:]))
+    return (angle_sig,start_dir)
+
+def parse_bookkeeper(angle_sig):
+    mask = decode_bookkeeper(angle_sig)
+    return "Bookkeeper's Gambit ("+mask+")" if mask else None
 
 def dict_lookup(angle_sig,pattern_dict):
     if not pattern_dict: return None
@@ -158,128 +458,328 @@ def dict_lookup(angle_sig,pattern_dict):
     except KeyError:
         return None
 
-def gs_lookup(x_vals,y_vals,great_spells):
+def great_spell_key(points):
+    # rotation- and translation-independent key for the set of vertices in a pattern
+    # each of the six rotations is shifted so its smallest vertex sits at the origin,
+    # and the smallest of those six vertex lists is used as the key
+    points = set(points)
+    best = None
+    for i in range(6):
+        ordered = sorted(points)
+        q0,r0 = ordered[0]
+        shifted = tuple((q-q0,r-r0) for q,r in ordered)
+        if best is None or shifted < best: best = shifted
+        # rotate 60 degrees counterclockwise
+        points = {(-r,q+r) for q,r in points}
+    return best
+
+def convert_great_spells(entries):
+    # convert an old-style list of [pointlist,name] pairs into a key -> name dict
+    # the first entry wins when two names share a shape, which keeps Summon Rain ahead of Dispel Rain
+    great_spells = {}
+    for points,name in entries:
+        key = great_spell_key(to_lattice([p[0] for p in points],[p[1] for p in points]))
+        great_spells.setdefault(key,name)
+    return great_spells
+
+def gs_lookup(points,great_spells):
     if not great_spells: return None
-    # convert the x and y lists into a single list of points
-    points = []
-    for i in range(len(x_vals)):
-        points.append([x_vals[i],y_vals[i]])
-
-    # remove duplicate points
-    for point in points:
-            new_list = [point]
-            for other_point in points:
-                if not(abs(point[0]-other_point[0])<0.1 and abs(point[1]-other_point[1])<0.1):
-                    new_list.append(other_point)
-            points = new_list
-
-    # shift pointlist so the location (0,0) is the bottom left corner
-    lowest = [min(x_vals),min(y_vals)]
-    for i in range(len(points)):
-        points[i][0] -= lowest[0]
-        points[i][1] -= lowest[1]
-
-    # compare pointlist to all possible great spell pointlists
-    for entry in great_spells:
-        same = True
-        for check in entry[0]:
-            matched = False
-            for point in points:
-                if(abs(point[0]-check[0])<0.1 and abs(point[1]-check[1])<0.1):
-                    matched = True
-            if not matched:
-                same = False
-        # if a pointlist matches, return its associated great spell
-        if same and len(entry[0])==len(points):
-            return entry[1]
-
-    # if no matches were found, it's not a known great spell
-    return None
-
-def plot_monochrome(plot_data,settings):
-    x_vals,y_vals,scale,start_angle = plot_data
-    for i in range(len(x_vals)-1):
-        plt.plot(x_vals[i:i+2],y_vals[i:i+2],color=settings["monochrome_color"],lw=scale)
-        plt.plot(x_vals[i],y_vals[i],'ko',ms=2*scale)
-    plt.plot(x_vals[-1],y_vals[-1],'ko',ms=2*scale)
-
-def plot_gradient(plot_data,settings):
-    x_vals,y_vals,scale,start_angle = plot_data
-    line_count = len(x_vals)-1
-    colors = colormaps[settings["gradient_colormap"]]
-
-    # plot start-direction triangle
-    plt.plot(x_vals[1]/2.15,y_vals[1]/2.15,color=colormaps[settings["gradient_colormap"]](0.999),marker=(3,0,start_angle),ms=2.9*settings["arrow_scale"]*scale)
-
-    # draw the pttern
-    for i in range(line_count):
-        plt.plot(x_vals[i:i+2],y_vals[i:i+2],color=colors(1-i/line_count),lw=scale)
-        plt.plot(x_vals[i],y_vals[i],'ko',ms=2*scale)
-
-    # mark the last point
-    plt.plot(x_vals[-1],y_vals[-1],'ko',ms=3*scale)
-    plt.plot(x_vals[-1],y_vals[-1],color=colors(0),marker='o',ms=1.5*scale)
-
-    # mark the first point
-    plt.plot(x_vals[0],y_vals[0],'ko',ms=3*scale)
-    plt.plot(x_vals[0],y_vals[0],color=colors(0.999),marker='o',ms=1.5*scale) 
-
-def plot_intersect(plot_data,settings):
-    x_vals,y_vals,scale,start_angle = plot_data
-    line_count = len(x_vals)-1
-    used_points = []
-    colors = settings["intersect_colors"]
+    return great_spells.get(great_spell_key(points))
+
+def build_name_index(names):
+    # prebuilt lookup tables for format_pattern, rebuilt whenever the name registry changes
+    # exact maps lowercased names to names, grams maps every 1-3 letter chunk to the names containing it,
+    # and patterns maps names to their (angle_sig,start_dir,force_mono) with aliases already resolved
+    exact = {}
+    grams = {}
+    patterns = {}
+    for name in names:
+        entry = names[name]
+        lower = name.lower()
+        exact.setdefault(lower,name)
+        for size in (1,2,3):
+            for i in range(len(lower)-size+1):
+                bucket = grams.setdefault(lower[i:i+size],[])
+                if not bucket or bucket[-1] != name: bucket.append(name)
+        if entry[0]:
+            if entry[1] in names: patterns[name] = tuple(names[entry[1]][1:])
+        else:
+            patterns[name] = tuple(entry[1:])
+    return (exact,grams,patterns)
+
+def name_lookup(raw_input,name_index):
+    # returns every name containing raw_input, or just the one name if it's an exact match
+    exact,grams,patterns = name_index
+    if raw_input in exact:
+        return [exact[raw_input]]
+    if len(raw_input) <= 3:
+        return list(grams.get(raw_input,[]))
+
+    # start from the rarest chunk of the input, then confirm the full substring
+    shortest = None
+    for i in range(len(raw_input)-2):
+        bucket = grams.get(raw_input[i:i+3],[])
+        if shortest is None or len(bucket) < len(shortest): shortest = bucket
+        if not shortest: return []
+    return [name for name in shortest if raw_input in name.lower()]
+
+# every draw mode is described as a list of shapes, so any backend can draw it the same way
+# ("lines",segments,colors,width) - one color per ((x1,y1),(x2,y2)) segment, width in points
+# ("dots",points,size,color) - round markers, size in points like plt.plot's ms
+# ("triangles",arrows,size) - arrows is a list of (x,y,angle,color)
+# shapes are listed in drawing order, so later ones go on top
+
+def monochrome_shapes(plot_data,settings):
+    x_vals,y_vals,scale,start_angle = plot_data[:4]
+    points = list(zip(x_vals,y_vals))
+    return [("lines",list(zip(points,points[1:])),[settings["monochrome_color"]]*(len(points)-1),scale),
+            ("dots",points,2*scale,"black")]
+
+def gradient_shapes(plot_data,settings):
+    x_vals,y_vals,scale,start_angle = plot_data[:4]
+    points = list(zip(x_vals,y_vals))
+    line_count = len(points)-1
+    colormap = load_colormap(settings["gradient_colormap"])
+    first = hex_color(colormap(0.999))
+    last = hex_color(colormap(0))
+
+    # start-direction triangle, then the pattern, looking up every segment's color in one call
+    return [("triangles",[(x_vals[1]/2.15,y_vals[1]/2.15,start_angle,first)],2.9*settings["arrow_scale"]*scale),
+            ("lines",list(zip(points,points[1:])),[hex_color(color) for color in colormap([1-i/line_count for i in range(line_count)])],scale),
+            ("dots",points[:-1],2*scale,"black"),
+            # mark the last point, then the first
+            ("dots",points[-1:],3*scale,"black"),
+            ("dots",points[-1:],1.5*scale,last),
+            ("dots",points[:1],3*scale,"black"),
+            ("dots",points[:1],1.5*scale,first)]
+
+@lru_cache(maxsize=256)
+def intersect_schedule(points,color_count):
+    # works out where intersect mode changes color, from a tuple of lattice points and the number of colors
+    # returns the color index of each segment and a list of (point index,new color index) for every change
+    # the line changes color when it comes back to a point it's already visited in the same color,
+    # and every earlier visit to that point in that color then counts as the next color instead
+    # colors past the fourth also match the visits in color 3-color%3
+    visits = {}
     color_index = 0
-    
-    # plot start-direction triangle
-    plt.plot(x_vals[1]/2.15,y_vals[1]/2.15,color=settings["intersect_colors"][0],marker=(3,0,start_angle),ms=2.9*settings["arrow_scale"]*scale)
-    
-    for i in range(line_count+1):
-        point = [x_vals[i],y_vals[i],color_index]
-        repeats = False
-
-        # check if we've already been to this point, with this line color
-        # doing this with if(j==point) doesn't work because of floating-point jank
-        for j in used_points:
-            same_color = color_index==j[2] or (3-color_index%3==j[2] and color_index>3)
-            if abs(point[0]-j[0])<0.1 and abs(point[1]-j[1])<0.1 and same_color:
-                repeats = True
-                used_points[used_points.index(j)][2] += 1
-
-        # if the condition is true, cycle the line color to the next option
-        # then draw a half-line backwards to mark the beginning of the new segment
-        if repeats:
-            color_index += 1
-            color_index %= len(colors)
-            back_half = ((x_vals[i-1]+point[0])/2,(y_vals[i-1]+point[1])/2)
-            plt.plot((point[0],back_half[0]),(point[1],back_half[1]),color=colors[color_index],lw=scale)
-
-            # draw a triangle to mark the direction of the new color
-            if(abs(y_vals[i]-y_vals[i-1])<0.1):
-                if(x_vals[i]>x_vals[i-1]): angle = 270
-                else: angle = 90
-            elif(y_vals[i]>y_vals[i-1]):
-                if(x_vals[i]>x_vals[i-1]): angle = 330
-                else: angle = 30
-            else:
-                if(x_vals[i]>x_vals[i-1]): angle = 210
-                else: angle = 150
-            plt.plot(back_half[0],back_half[1],marker=(3,0,angle),color=colors[color_index],ms=2*settings["arrow_scale"]*scale)
+    segment_colors = []
+    changes = []
+    for i,point in enumerate(points):
+        seen = visits.setdefault(point,{})
+        same = {color_index,3-color_index%3} if color_index > 3 else {color_index}
+        if any(color in seen for color in same):
+            moved = {color:seen.pop(color) for color in same if color in seen}
+            for color,count in moved.items(): seen[color+1] = seen.get(color+1,0)+count
+            color_index = (color_index+1)%color_count
+            changes.append((i,color_index))
         else:
-            used_points.append(point)
+            seen[color_index] = seen.get(color_index,0)+1
+        if i != len(points)-1: segment_colors.append(color_index)
+    return (segment_colors,changes)
 
-        # only draw point+line if we're not at the end
-        if(i!=line_count):
-            plt.plot(x_vals[i:i+2],y_vals[i:i+2],color=colors[color_index],lw=scale)
-            plt.plot(point[0],point[1],'ko',ms=2*scale)       
-
-    # mark the last point
-    plt.plot(x_vals[-1],y_vals[-1],'ko',ms=3*scale)
-    plt.plot(x_vals[-1],y_vals[-1],color=colors[color_index],marker='o',ms=1.5*scale)
-
-    # mark the first point
-    plt.plot(x_vals[0],y_vals[0],'ko',ms=3*scale)
-    plt.plot(x_vals[0],y_vals[0],color=colors[0],marker='o',ms=1.5*scale)
+def intersect_shapes(plot_data,settings):
+    x_vals,y_vals,scale,start_angle,lattice = plot_data
+    colors = settings["intersect_colors"]
+    segment_indices,changes = intersect_schedule(tuple(lattice),len(colors))
+    segment_colors = [colors[color_index] for color_index in segment_indices]
+    color_index = changes[-1][1] if changes else 0
+    half_lines = []
+    arrows = []
+
+    # each color change gets a half-line drawn backwards to mark the beginning of the new segment,
+    # and a triangle to mark the direction of the new color
+    for i,change_index in changes:
+        back_half = ((x_vals[i-1]+x_vals[i])/2,(y_vals[i-1]+y_vals[i])/2)
+        half_lines.append(((x_vals[i],y_vals[i]),back_half))
+        if(abs(y_vals[i]-y_vals[i-1])<0.1):
+            if(x_vals[i]>x_vals[i-1]): angle = 270
+            else: angle = 90
+        elif(y_vals[i]>y_vals[i-1]):
+            if(x_vals[i]>x_vals[i-1]): angle = 330
+            else: angle = 30
+        else:
+            if(x_vals[i]>x_vals[i-1]): angle = 210
+            else: angle = 150
+        arrows.append((back_half[0],back_half[1],angle,colors[change_index]))
+
+    points = list(zip(x_vals,y_vals))
+    return [("triangles",[(x_vals[1]/2.15,y_vals[1]/2.15,start_angle,colors[0])],2.9*settings["arrow_scale"]*scale),
+            ("lines",list(zip(points,points[1:]))+half_lines,segment_colors+[arrow[3] for arrow in arrows],scale),
+            ("dots",points[:-1],2*scale,"black"),
+            ("triangles",arrows,2*settings["arrow_scale"]*scale),
+            # mark the last point, then the first
+            ("dots",points[-1:],3*scale,"black"),
+            ("dots",points[-1:],1.5*scale,colors[color_index]),
+            ("dots",points[:1],3*scale,"black"),
+            ("dots",points[:1],1.5*scale,colors[0])]
+
+def pattern_shapes(plot_data,force_mono,settings):
+    # shapes for whichever static draw mode is selected, falling back to monochrome
+    if force_mono: return monochrome_shapes(plot_data,settings)
+    match settings["draw_mode"]:
+        case "intersect": return intersect_shapes(plot_data,settings)
+        case "gradient": return gradient_shapes(plot_data,settings)
+        case _: return monochrome_shapes(plot_data,settings)
+
+def load_colormap(name):
+    # gradient mode only needs matplotlib's colormap registry, which loads much faster than pyplot
+    from matplotlib import colormaps
+    return colormaps[name]
+
+def hex_color(rgba):
+    return "#"+"".join(format(round(channel*255),"02x") for channel in rgba[:3])
+
+def draw_shapes(shapes):
+    # draws a shape list onto the current matplotlib axes
+    ax = plt.gca()
+    for shape in shapes:
+        match shape[0]:
+            case "lines":
+                # every segment goes into a single collection rather than getting its own Line2D
+                # capstyle matches plt.plot's default, so the joins look the same as before
+                ax.add_collection(LineCollection(shape[1],colors=shape[2],linewidths=shape[3],capstyle="projecting",zorder=2))
+                ax.autoscale_view()
+            case "dots":
+                ax.plot([point[0] for point in shape[1]],[point[1] for point in shape[1]],"o",color=shape[3],ms=shape[2])
+            case "triangles":
+                plot_arrows(shape[1],shape[2])
+
+def place_shapes(shapes,scale,x_offset,y_offset):
+    # moves a shape list somewhere else on the same axes, scaling where things are but not how big they're drawn
+    def place(x,y): return (x*scale+x_offset,y*scale+y_offset)
+    placed = []
+    for shape in shapes:
+        match shape[0]:
+            case "lines": placed.append(("lines",[(place(*start),place(*end)) for start,end in shape[1]])+shape[2:])
+            case "dots": placed.append(("dots",[place(*point) for point in shape[1]])+shape[2:])
+            case "triangles": placed.append(("triangles",[place(x,y)+(angle,color) for x,y,angle,color in shape[1]],shape[2]))
+    return placed
+
+def merge_shapes(shapes):
+    # combines shapes that are drawn the same way, so a whole grid of patterns only needs a handful of artists
+    # the merged shapes are drawn in the order each kind first turned up, which only works because grid cells don't overlap
+    merged = {}
+    for shape in shapes:
+        match shape:
+            case ("lines",segments,colors,width):
+                entry = merged.setdefault(("lines",width),("lines",[],[],width))
+                entry[1].extend(segments)
+                entry[2].extend(colors)
+            case ("dots",points,size,color):
+                merged.setdefault(("dots",size,color),("dots",[],size,color))[1].extend(points)
+            case ("triangles",arrows,size):
+                merged.setdefault(("triangles",size),("triangles",[],size))[1].extend(arrows)
+    return list(merged.values())
+
+def plot_arrows(arrows,size):
+    # all direction triangles in one collection, each with its own rotation and color
+    # arrows is a list of (x,y,angle,color), and size is in points like plt.plot's ms
+    if not arrows: return
+    paths = []
+    for arrow in arrows:
+        marker = MarkerStyle((3,0,arrow[2]))
+        paths.append(marker.get_path().transformed(marker.get_transform()))
+    ax = plt.gca()
+    triangles = PathCollection(paths,sizes=[size**2],facecolors=[arrow[3] for arrow in arrows],edgecolors="face",linewidths=1,
+                               offsets=[arrow[:2] for arrow in arrows],offset_transform=ax.transData,
+                               transform=IdentityTransform(),zorder=2)
+    ax.add_collection(triangles,autolim=False)
+
+def view_limits(x_vals,y_vals,pad_factor):
+    # the x and y limits matplotlib would end up with - autoscaled with 5% margins, widened if flat, then padded
+    limits = []
+    for vals in (x_vals,y_vals):
+        low,high = min(vals),max(vals)
+        margin = (high-low)*0.05
+        low,high = low-margin,high+margin
+        if high-low < 1e-9:
+            low,high = (low-0.05*abs(low),high+0.05*abs(high)) if low else (-0.05,0.05)
+        limits.append((low,high))
+    pad = min((limits[0][1]-limits[0][0])/pad_factor,(limits[1][1]-limits[1][0])/pad_factor)
+    return [(low-pad,high+pad) for low,high in limits]
+
+def view_transform(plot_data,pad_factor,width,height):
+    # pixels per unit and where the origin lands, for drawing into a width x height image with equal aspect
+    (x_min,x_max),(y_min,y_max) = view_limits(plot_data[0],plot_data[1],pad_factor)
+    pixels = min(width/(x_max-x_min),height/(y_max-y_min))
+    return (pixels,(width-(x_max-x_min)*pixels)/2-x_min*pixels,(height-(y_max-y_min)*pixels)/2+y_max*pixels)
+
+def svg_number(value):
+    return format(value,".2f").rstrip("0").rstrip(".")
+
+def pattern_svg(plot_data,force_mono,settings,size=(4,4)):
+    # draws a pattern as SVG text without going through matplotlib, matching its 100 dpi PNGs
+    settings,pad_factor = pattern_style(plot_data,settings)
+    width,height = size[0]*100,size[1]*100
+    pixels,left,top = view_transform(plot_data,pad_factor,width,height)
+    point = 100/72
+
+    svg = ['<svg xmlns="http://www.w3.org/2000/svg" width="'+str(width)+'" height="'+str(height)+'" viewBox="0 0 '+str(width)+" "+str(height)+'">']
+    if not settings["list_mode"]: svg.append('<rect width="100%" height="100%" fill="white"/>')
+    for shape in pattern_shapes(plot_data,force_mono,settings):
+        match shape[0]:
+            case "lines":
+                # runs of segments that share a color go into one path, each segment with its own square caps
+                runs = []
+                for segment,color in zip(shape[1],shape[2]):
+                    if not runs or runs[-1][0] != color: runs.append((color,[]))
+                    runs[-1][1].append(segment)
+                for color,segments in runs:
+                    path_data = "".join("M"+svg_number(left+x1*pixels)+","+svg_number(top-y1*pixels)+"L"+svg_number(left+x2*pixels)+","+svg_number(top-y2*pixels)
+                                        for (x1,y1),(x2,y2) in segments)
+                    svg.append('<path d="'+path_data+'" stroke="'+color+'" stroke-width="'+svg_number(shape[3]*point)+'" stroke-linecap="square" fill="none"/>')
+            case "dots":
+                # matplotlib's markers have a 1 point edge in the same color
+                radius = svg_number((shape[2]+1)/2*point)
+                for x,y in shape[1]:
+                    svg.append('<circle cx="'+svg_number(left+x*pixels)+'" cy="'+svg_number(top-y*pixels)+'" r="'+radius+'" fill="'+shape[3]+'"/>')
+            case "triangles":
+                radius = shape[2]/2*point
+                for x,y,angle,color in shape[1]:
+                    corners = [math.radians(90+angle+120*i) for i in range(3)]
+                    corners = " ".join(svg_number(left+x*pixels+radius*math.cos(corner))+","+svg_number(top-y*pixels-radius*math.sin(corner)) for corner in corners)
+                    svg.append('<polygon points="'+corners+'" fill="'+color+'" stroke="'+color+'" stroke-width="'+svg_number(point)+'"/>')
+    svg.append("</svg>\n")
+    return "\n".join(svg)
+
+def pattern_png(plot_data,force_mono,settings,filename,size=(4,4),supersample=2):
+    # draws a pattern straight into a Pillow image and saves it, for exporting lots of PNGs without matplotlib
+    # it's drawn at a multiple of the final size and shrunk down, which antialiases it
+    from PIL import Image
+    from PIL import ImageDraw
+    settings,pad_factor = pattern_style(plot_data,settings)
+    width,height = size[0]*100*supersample,size[1]*100*supersample
+    pixels,left,top = view_transform(plot_data,pad_factor,width,height)
+    point = 100/72*supersample
+
+    # list mode cells are transparent, same as their cached renders
+    if settings["list_mode"]: image = Image.new("RGBA",(width,height),(255,255,255,0))
+    else: image = Image.new("RGB",(width,height),"white")
+    draw = ImageDraw.Draw(image)
+    for shape in pattern_shapes(plot_data,force_mono,settings):
+        match shape[0]:
+            case "lines":
+                half = shape[3]*point/2
+                for ((x1,y1),(x2,y2)),color in zip(shape[1],shape[2]):
+                    x1,y1,x2,y2 = left+x1*pixels,top-y1*pixels,left+x2*pixels,top-y2*pixels
+                    # stretch both ends by half the line width, for the same square caps matplotlib uses
+                    length = math.hypot(x2-x1,y2-y1) or 1
+                    dx,dy = (x2-x1)/length*half,(y2-y1)/length*half
+                    draw.line((x1-dx,y1-dy,x2+dx,y2+dy),fill=color,width=round(2*half))
+            case "dots":
+                # matplotlib's markers have a 1 point edge in the same color
+                radius = (shape[2]+1)/2*point
+                for x,y in shape[1]:
+                    x,y = left+x*pixels,top-y*pixels
+                    draw.ellipse((x-radius,y-radius,x+radius,y+radius),fill=shape[3])
+            case "triangles":
+                # a 1 point edge pushes a triangle's corners out by a whole point
+                radius = (shape[2]/2+1)*point
+                for x,y,angle,color in shape[1]:
+                    x,y = left+x*pixels,top-y*pixels
+                    corners = [math.radians(90+angle+120*i) for i in range(3)]
+                    draw.polygon([(x+radius*math.cos(corner),y-radius*math.sin(corner)) for corner in corners],fill=color)
+    image.reduce(supersample).save(filename)
 
 def format_pattern(raw_input,registry,settings):
     raw_input = raw_input.lower()
@@ -296,50 +796,21 @@ def format_pattern(raw_input,registry,settings):
     if raw_input.startswith("bookkeeper") or all(c in "v-" for c in raw_input):
         force_mono = False
         by_name = True
-        v_ind = raw_input.find("v")
-        dash_ind = raw_input.find("-")
-        if -1 != v_ind < dash_ind != -1: start = v_ind
-        elif -1 != dash_ind < v_ind != -1: start = dash_ind
-        elif v_ind == -1: start = dash_ind
-        else: start = v_ind
-        if raw_input[start]=="v":
-            start_dir = "southeast"
-            angle_sig = "a"
-        else:
-            start_dir = "east"
-            angle_sig = ""
-        for i in range(start+1,len(raw_input)):
-            char = raw_input[i]
-            if char == "v":
-                if raw_input[i-1] == "v":
-                    angle_sig += "da"
-                else:
-                    angle_sig += "ea"
-            elif char == "-":
-                if raw_input[i-1] == "v":
-                    angle_sig += "e"
-                else:
-                    angle_sig += "w"
+        # the name and any brackets or spaces around the mask are ignored
+        pattern = encode_bookkeeper("".join(char for char in raw_input if char in "v-"))
+        if not pattern:
+            if not settings["list_mode"]: print("Error - no Bookkeeper's Gambit mask.\n-----")
+            return (raw_input,None,None)
+        angle_sig,start_dir = pattern
 
     # elif input is the name of a pattern, use that
     elif all(registry):
-        matches = []
-        for name in registry[2]:
-            if raw_input == name.lower():
-                matches = [name]
-                break
-            elif raw_input in name.lower():
-                matches.append(name)
-        if len(matches) == 0:
-            by_name = False
-        elif len(matches) == 1:
+        matches = name_lookup(raw_input,registry[4])
+        if len(matches) == 1 and matches[0] in registry[4][2]:
             by_name = True
-            name = matches[0]
-            if registry[2][name][0]:
-                ref_name = registry[2][name][1]
-                angle_sig,start_dir,force_mono = registry[2][ref_name][1:]
-            else:
-                angle_sig,start_dir,force_mono = registry[2][name][1:]
+            angle_sig,start_dir,force_mono = registry[4][2][matches[0]]
+        elif len(matches) <= 1:
+            by_name = False
         else:
             if not settings["list_mode"]:
                 print("Found multiple matches for '"+raw_input+"':")
@@ -377,9 +848,167 @@ def format_pattern(raw_input,registry,settings):
     # return properly formatted pattern info
     return angle_sig,start_dir,force_mono
 
-def main(input_val,registry,settings,ax=None):
+def new_pattern_axes(width,height=None):
+    # a figure with one borderless axes filling it, square unless a height is given
+    ax = plt.figure(figsize=(width,height or width)).add_axes([0,0,1,1])
+    ax.set_aspect("equal")
+    ax.axis("off")
+    return ax
+
+def pattern_style(plot_data,settings):
+    # list mode cells are small, so they get smaller arrows on small patterns and less padding around the edges
+    # returns the settings to draw with and the padding factor
+    if not settings["list_mode"]: return (settings,20)
+    if plot_data[2] < 2.5: settings = dict(settings,arrow_scale=settings["arrow_scale"]-0.3)
+    return (settings,5)
+
+def plot_pattern(plot_data,force_mono,settings,ax):
+    # draws a pattern into ax with the list mode size tweaks and edge padding, returning any animation
+    settings,pad_factor = pattern_style(plot_data,settings)
+    ani = draw_pattern(plot_data,force_mono,settings,ax)
+    with timed("pad"): pad_axes(ax,pad_factor)
+    return ani
+
+def draw_pattern(plot_data,force_mono,settings,ax):
+    # run the selected draw function, returning the animation if there is one
+    if force_mono:
+        draw_shapes(monochrome_shapes(plot_data,settings))
+        return None
+    match settings["draw_mode"]:
+        case "intersect" | "monochrome" | "gradient":
+            draw_shapes(pattern_shapes(plot_data,force_mono,settings))
+        case "animated":
+            if settings["anim_speed"] == "N/A":
+                print("WARNING - The animation module (hex_anim.py) could not be found.")
+                print("          Displaying pattern in monochrome mode instead.")
+                draw_shapes(monochrome_shapes(plot_data,settings))
+            else:
+                return hex_anim.plot_animated(plot_data,settings,ax)
+        case "disabled":
+            pass
+        case _:
+            print("Config error, this shouldn't happen")
+    return None
+
+def pad_axes(ax,pad_factor):
+    # pad edges to avoid dot cutoff
+    x_min,x_max = ax.get_xlim()
+    y_min,y_max = ax.get_ylim()
+    pad = min((x_max-x_min)/pad_factor,(y_max-y_min)/pad_factor)
+    ax.set_xlim(x_min-pad,x_max+pad)
+    ax.set_ylim(y_min-pad,y_max+pad)
+
+# running totals for the render cache, shown in the admin console
+cache_stats = {"hits":0,"misses":0,"evictions":0,"bytes":None}
+
+def render_key(pattern_data,settings,size):
+    # hash of the pattern plus every setting that changes how it's drawn
+    fields = [list(pattern_data),size]+[settings[name] for name in ("draw_mode","list_mode","scale_factor","arrow_scale",
+                                                                     "intersect_colors","gradient_colormap","monochrome_color")]
+    return sha256(json.dumps(fields).encode()).hexdigest()
+
+def cached_render(pattern_data,plot_data,settings,size):
+    # returns the filename of a cached render of this pattern, drawing and storing it first if needed
+    filename = path.join(settings["cache_path"],render_key(pattern_data,settings,size)+".png")
+    if path.isfile(filename):
+        cache_stats["hits"] += 1
+        # the modification time doubles as the last-used time for eviction
+        utime(filename)
+        return filename
+    cache_stats["misses"] += 1
+
+    # list mode cells are drawn at a higher resolution, since they get scaled to fit the grid
+    makedirs(settings["cache_path"],exist_ok=True)
+    ax = new_pattern_axes(*size)
+    plot_pattern(plot_data,pattern_data[2],settings,ax)
+    temp_name = filename+"."+str(getpid())+".tmp"
+    ax.figure.savefig(temp_name,format="png",dpi=200 if settings["list_mode"] else 100,transparent=settings["list_mode"])
+    plt.close(ax.figure)
+    replace(temp_name,filename)
+
+    trim_cache(settings,path.getsize(filename))
+    return filename
+
+def trim_cache(settings,added):
+    # delete the least recently used renders until the cache fits in cache_size megabytes
+    if cache_stats["bytes"] is None:
+        cache_stats["bytes"] = sum(entry.stat().st_size for entry in scandir(settings["cache_path"]) if entry.name.endswith(".png"))
+    else:
+        cache_stats["bytes"] += added
+    limit = settings["cache_size"]*1024*1024
+    if cache_stats["bytes"] <= limit: return
+
+    entries = [entry for entry in scandir(settings["cache_path"]) if entry.name.endswith(".png")]
+    cache_stats["bytes"] = sum(entry.stat().st_size for entry in entries)
+    for entry in sorted(entries,key=lambda entry: entry.stat().st_mtime):
+        if cache_stats["bytes"] <= limit: break
+        try:
+            remove(entry.path)
+        except FileNotFoundError:
+            continue
+        cache_stats["bytes"] -= entry.stat().st_size
+        cache_stats["evictions"] += 1
+
+class PatternIdentifier:
+    # identifies patterns against one registry, only trying the lookups a pattern could possibly match
+    # results are kept for the most recently seen patterns, since spells use the same few patterns over and over,
+    # and the whole thing is rebuilt whenever the registry changes so they never go stale
+
+    def __init__(self,registry,size=4096):
+        self.patterns = registry[0]
+        self.great_spells = registry[1]
+        # a great spell can only match a pattern with the same number of vertices
+        self.great_sizes = {len(key) for key in registry[1] or {}}
+        self.size = size
+        self.results = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def identify(self,angle_sig,start_dir,points):
+        # returns the pattern's name, or None if it isn't recognized
+        # points are the pattern's lattice points from convert_to_points, or None if it can't be drawn
+        # the start direction is part of the key because it decides between Summon and Dispel Rain
+        # the service shares one of these between threads, so a result can be evicted at any point,
+        # which just counts as a miss
+        key = (angle_sig,start_dir)
+        try:
+            self.results.move_to_end(key)
+            result = self.results[key]
+            self.hits += 1
+            return result
+        except KeyError:
+            self.misses += 1
+        result = self.lookup(angle_sig,points)
+        self.results[key] = result
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    def lookup(self,angle_sig,points):
+        with timed("dict_lookup"): result = dict_lookup(angle_sig,self.patterns)
+        # only patterns that could be drawn have a shape to compare
+        if not result and points and self.great_sizes:
+            with timed("gs_lookup"):
+                vertices = set(points)
+                if len(vertices) in self.great_sizes: result = self.great_spells.get(great_spell_key(vertices))
+        # numbers and bookkeeper's gambits never share a first char, so only one of them needs trying
+        if not result and angle_sig.startswith(("aqaa","dedd")):
+            with timed("parse_number"): result = parse_number(angle_sig)
+        elif not result:
+            with timed("parse_bookkeeper"): result = parse_bookkeeper(angle_sig)
+
+        # dispel rain override - it's the one that doesn't end to the west of where it starts
+        if result == "Summon Rain" and points and 2*points[-1][0]+points[-1][1] >= 0:
+            result = "Dispel Rain"
+
+        return result
+
+    def hit_rate(self):
+        return self.hits/(self.hits+self.misses) if self.hits+self.misses else 0
+
+def main(input_val,registry,settings):
     if isinstance(input_val,str):
-        angle_sig,start_dir,force_mono = format_pattern(input_val,registry,settings)
+        with timed("parse"): angle_sig,start_dir,force_mono = format_pattern(input_val,registry,settings)
     else:
         angle_sig,start_dir,force_mono = input_val
 
@@ -387,247 +1016,792 @@ def main(input_val,registry,settings,ax=None):
         return None
     
     # convert input to x and y values
-    plot_data = convert_to_points(angle_sig,start_dir,settings)
-    x_vals,y_vals,scale,start_angle = plot_data
+    with timed("geometry"): plot_data = convert_to_points(angle_sig,start_dir,settings)
+    x_vals,y_vals,scale,start_angle,points = plot_data
     if not x_vals:
-        if settings["list_mode"]: output = "Invalid Pattern (self-overlapping)"
-        else: print("Error - that pattern overlaps itself.\n-----")
+        print("Error - that pattern overlaps itself.\n-----")
     elif not y_vals:
-        if settings["list_mode"]: output = "Invalid Pattern (unreadable)"
-        else: print("Error - invalid character in angle signature.\n-----")
+        print("Error - invalid character in angle signature.\n-----")
 
     # pattern identification
-    if settings["identify_pattern"]=="on" or settings["list_mode"]:
-        result = None
-
-        # attempt to identify pattern with various methods
-        try:
-            if result := dict_lookup(angle_sig,registry[0]): pass
-            elif result := gs_lookup(x_vals,y_vals,registry[1]): pass
-            elif result := parse_bookkeeper(angle_sig): pass
-            elif angle_sig.startswith(("aqaa","dedd")): result = parse_number(angle_sig)
-        except TypeError:
-            if settings["list_mode"]: result = "Unknown Pattern (no pattern registry)"
-            else: result = "Unknown - no pattern registry"
-
-        # dispel rain override
-        if result == "Summon Rain" and x_vals[0]-x_vals[-1] < 0.1:
-            result = "Dispel Rain"
+    if settings["identify_pattern"]=="on":
+        with timed("identify"): result = registry[5].identify(angle_sig,start_dir,points if x_vals and y_vals else None)
 
         # if no matches found, pattern is unrecognized
-        if not result:
-            if settings["list_mode"]: result = "Unknown Pattern ("+angle_sig+")"
-            else: result = "Unknown - unrecognized pattern"
-
-        # deal with result based on mode
-        if(settings["list_mode"]): output = result
-        else: print("This pattern is: "+result)
+        if not result: result = "Unknown - unrecognized pattern"
+        print("This pattern is: "+result)
 
-    # pre-plot scaling
-    if settings["list_mode"]:
-        if scale < 2.5: settings["arrow_scale"] -= 0.3
-        elif scale < 1.9: settings["arrow_scale"] -= 0.5
-    else:
-        ax = plt.figure(figsize=(4,4)).add_axes([0,0,1,1])
-        ax.set_aspect("equal")
-        ax.axis("off")
+    # invalid patterns have nothing to draw
+    if not (x_vals and y_vals):
+        return None
+    ani = draw_and_save((angle_sig,start_dir,force_mono),plot_data,settings)
     
-    # run the selected draw function
-    if force_mono:
-        plot_monochrome(plot_data,settings)
+    # display the final image, if enabled
+    if settings["draw_mode"] == "disabled": plt.close()
     else:
-        match settings["draw_mode"]:
-            case "intersect":
-                plot_intersect(plot_data,settings)
-            case "monochrome":
-                plot_monochrome(plot_data,settings)
-            case "gradient":
-                plot_gradient(plot_data,settings)
-            case "animated":
-                if settings["anim_speed"] == "N/A":
-                    print("WARNING - The animation module (hex_anim.py) could not be found.")
-                    print("          Displaying pattern in monochrome mode instead.")
-                    plot_monochrome(plot_data,settings)
-                else:
-                    ani = hex_anim.plot_animated(plot_data,settings,ax)            
-            case "disabled":
-                pass
-            case _:
-                print("Config error, this shouldn't happen")
+        with timed("show"): plt.show()
+    
+    print("-----")
 
-    # post-plot scaling
-    if settings["list_mode"]:
-        if scale < 1.9: settings["arrow_scale"] += 0.5
-        elif scale < 2.5: settings["arrow_scale"] += 0.3
-        pad_factor = 5
+def output_filename(angle_sig,start_dir,settings):
+    # where to save a pattern in the output path, without its extension or overwriting anything already there
+    if settings["output_path"]=="here" : filename = start_dir+"_"+angle_sig
+    else: filename = settings["output_path"]+"/"+start_dir+"_"+angle_sig
+    num = 1
+    while any(path.isfile(filename+ext) for ext in (".png",".gif",".webp",".svg")):
+        if(filename[-1]==str(num-1)): filename = filename[:-1]+str(num)
+        else: filename += ("_"+str(num))
+        num += 1
+    return filename
+
+def draw_and_save(pattern_data,plot_data,settings,ax=None):
+    # draws the pattern into ax, or a figure of its own, reusing an earlier render of it if there is one
+    # returns any animation, which has to be kept around until it's shown
+    angle_sig,start_dir,force_mono = pattern_data
+    use_cache = settings["render_cache"]=="on" and settings["draw_mode"] not in ("animated","disabled")
+    with timed("figure"):
+        load_pyplot()
+        if ax is None: ax = new_pattern_axes(4)
+    if use_cache:
+        with timed("cache"):
+            image = cached_render(pattern_data,plot_data,settings,[4,4])
+            ax.imshow(plt.imread(image))
+        ani = None
     else:
-        pad_factor = 20
-
-    # pad edges to avoid dot cutoff
-    x_min,x_max = ax.get_xlim()
-    y_min,y_max = ax.get_ylim()
-    pad = min((x_max-x_min)/pad_factor,(y_max-y_min)/pad_factor)
-    ax.set_xlim(x_min-pad,x_max+pad)
-    ax.set_ylim(y_min-pad,y_max+pad)
+        with timed("draw"): ani = plot_pattern(plot_data,force_mono,settings,ax)
 
     # save the final image, if enabled
     if(settings["output_path"]!="none"):
-        if settings["output_path"]=="here" : filename = start_dir+"_"+angle_sig
-        else: filename = settings["output_path"]+"/"+start_dir+"_"+angle_sig
-        num = 1
-        while path.isfile(filename+".png") or path.isfile(filename+".gif"):
-            if(filename[-1]==str(num-1)): filename = filename[:-1]+str(num)
-            else: filename += ("_"+str(num))
-            num += 1
-        if settings["draw_mode"] == "animated": ani.save(filename+".gif",writer=PillowWriter(fps=40))
-        else: plt.savefig(filename+".png")
-    
-    # display the final image, if enabled
-    if settings["list_mode"]: return output
-    elif settings["draw_mode"] == "disabled": plt.close()
-    else: plt.show()
-    
-    print("-----")
+        filename = output_filename(angle_sig,start_dir,settings)
+        with timed("save"):
+            if settings["draw_mode"] == "animated": hex_anim.save_animation(plot_data,settings,filename+"."+settings["anim_format"])
+            elif settings["image_format"] == "svg":
+                with open(filename+".svg",mode="w") as file: file.write(pattern_svg(plot_data,force_mono,settings))
+            elif use_cache: copyfile(image,filename+".png")
+            else: plt.savefig(filename+".png")
+    return ani
+
+# one iota of a parsed spell
+# kind is "pattern", "list", "vector", "number", "widget" or "entity"
+# value holds the formatted pattern for patterns and the parsed items for lists, and is None otherwise
+# straight out of the parser, anything that could be a pattern has kind "pattern" and no value yet
+# count is how many times in a row the iota appears, so repeats don't have to be stored one by one
+Iota = namedtuple("Iota","kind text value count",defaults=(1,))
+
+special_chars = re.compile(r"[][(),]")
+
+def parse_iotas(text,start=0):
+    # parses a comma-separated run of iotas, starting just inside the opening bracket if there is one
+    text = text.replace(";",",").replace(":"," -")
+    return parse_items(text,start)[0]
+
+def parse_items(text,i):
+    # recursive-descent parser that reads iotas up to the "]" closing the current list
+    # returns the parsed iotas and the position just past that "]"
+    items = []
+    while i < len(text):
+        char = text[i]
+        if char == "]":
+            return (items,i+1)
+        elif char == "[":
+            children,i = parse_items(text,i+1)
+            items.append(Iota("list",None,children))
+        elif char == "," or char.isspace():
+            i += 1
+        else:
+            end = leaf_end(text,i)
+            items.append(leaf_iota(text[i:end].strip()))
+            i = end
+    return (items,i)
 
-def string_to_spell(raw_input,wrapper=True):
-    # split string into list of iotas
+def leaf_end(text,i):
+    # finds the comma or bracket that ends a single iota, skipping over anything in parentheses
     nested = 0
-    raw_input = raw_input.replace(";",",").replace(":"," -")[1:-1]
-    for i in range(len(raw_input)):
-        if raw_input[i] in ("[","("): nested += 1
-        elif raw_input[i] in ("]",")"): nested -= 1
-        elif nested > 0 and raw_input[i] == ",":
-            raw_input = raw_input[:i]+";"+raw_input[i+1:]
-    raw_list = raw_input.split(", ")
-
+    while match := special_chars.search(text,i):
+        char = match.group()
+        i = match.end()
+        if char in "([": nested += 1
+        elif nested and char in ")]": nested -= 1
+        elif not nested and char in ",]": return match.start()
+    return len(text)
+
+def leaf_iota(text):
+    # sorts an iota by how it looks - anything that isn't obviously something else might be a pattern
+    if text.startswith("("): kind = "vector"
+    elif text.removeprefix("-").replace(".","",1).isnumeric(): kind = "number"
+    elif text.lower() in ("null","garbage","arimfexendrapuse"): kind = "widget"
+    else: kind = "pattern"
+    return Iota(kind,text,None)
+
+def pattern_iota(text,registry,settings):
+    formatted = format_pattern(text,registry,settings)
+    if formatted[1]: return Iota("pattern",text,formatted)
+    return Iota("entity",text,None)
+
+def string_to_spell(raw_input,registry,settings,wrapper=True):
+    # skip the list's opening bracket and parse everything inside it
+    with timed("parse"): return list(format_iotas(parse_iotas(raw_input,1),registry,settings,wrapper))
+
+def format_iotas(raw_list,registry,settings,wrapper=True):
     # add intro/retro wrapper
-    if wrapper:
-        raw_list.insert(0,"qqq west")
-        raw_list.append("eee east")
+    if wrapper: raw_list = chain([Iota("pattern","qqq west",None)],raw_list,[Iota("pattern","eee east",None)])
 
-    # translate iotas to formatted patterns if possible
+    # translate iotas to formatted patterns if possible, one at a time
     nested = 0
-    spell = []
     for iota in raw_list:
-        formatted = format_pattern(iota,registry,settings)
-        spell.append(formatted)
-        if formatted[0] == "qqq": nested += 1
-        elif formatted[0] == "eee": nested -= 1
-        elif formatted[0] == "qqqaw":
-            for i in range(2**nested-1):
-                spell.append(formatted)
-
-    return spell
+        if iota.kind == "list":
+            yield iota._replace(value=list(format_iotas(iota.value,registry,settings,False)))
+            continue
+        elif iota.kind != "pattern":
+            yield iota
+            continue
+        iota = pattern_iota(iota.text,registry,settings)
+        if iota.kind == "pattern":
+            if iota.value[0] == "qqq": nested += 1
+            elif iota.value[0] == "eee": nested -= 1
+            # every level of introspection doubles a consideration, which would grow exponentially if written out
+            elif iota.value[0] == "qqqaw": iota = iota._replace(count=2**max(nested,0))
+        yield iota
+
+def spell_pages(spell,settings):
+    # splits a spell into pages of at most grid_dims[2] iotas, reading it as it goes
+    page = []
+    for iota in spell:
+        page.append(iota)
+        if len(page) == settings["grid_dims"][2]:
+            yield page
+            page = []
+    if page: yield page
+
+def plot_spell_list(spell,settings,paged=False):
+    # lays the top-level iotas out in a grid and draws each one into its own cell
+    # nothing is identified here, and nested lists just get a placeholder
+    # every cell goes onto one axes measured in inches, which is far quicker to build than a subplot per cell
 
-def parse_spell_list(spell,registry,settings,meta=0):
+    # create figure to plot patterns into
+    # pages of a longer spell keep the full width even when they're short, so they all line up
+    rows = math.ceil(len(spell)/settings["grid_dims"][0])
+    cols = len(spell) if rows==1 and not paged else settings["grid_dims"][0]
+    width,height = cols+1,rows+1
+    cell_width,cell_height = width/cols,height/rows
+    with timed("figure"):
+        load_pyplot()
+        ax = new_pattern_axes(width,height)
+    markers = {"list":"$[]$","vector":"$\u27E8\u27E9$","number":"$\\#$","widget":"$?$","entity":"$@$"}
+    shapes = []
+    with timed("layout"):
+        for index,iota in enumerate(spell):
+            # each cell is drawn in the box its own subplot would have had - the cell shrunk to fit what's in it
+            center_x = (index%cols+0.5)*cell_width
+            center_y = height-(index//cols+0.5)*cell_height
+            corner = (center_x+min(cell_width,cell_height)/2,center_y+min(cell_width,cell_height)/2)
+
+            if iota.kind == "pattern":
+                plot_data = convert_to_points(iota.value[0],iota.value[1],settings)
+                if plot_data[0] and plot_data[1]:
+                    style,pad_factor = pattern_style(plot_data,settings)
+                    (x_min,x_max),(y_min,y_max) = view_limits(plot_data[0],plot_data[1],pad_factor)
+                    scale = min(cell_width/(x_max-x_min),cell_height/(y_max-y_min))
+                    x_offset = center_x-(x_min+x_max)/2*scale
+                    y_offset = center_y-(y_min+y_max)/2*scale
+                    shapes += place_shapes(pattern_shapes(plot_data,iota.value[2],style),scale,x_offset,y_offset)
+                    corner = (x_max*scale+x_offset,y_max*scale+y_offset)
+                    if(settings["output_path"]!="none"):
+                        render_pattern(iota.value,settings,output_filename(iota.value[0],iota.value[1],settings))
+
+            # repeated iotas share a single cell, marked with how many there are
+            if iota.count > 1:
+                ax.text(*corner,"×"+str(iota.count),ha="right",va="top",c=settings["monochrome_color"])
+
+            # draw placeholder symbol for non-pattern or meta-eval
+            if iota.kind in markers:
+                ax.plot(center_x,center_y,marker=markers[iota.kind],ms=50,c=settings["monochrome_color"])
+
+    with timed("draw"): draw_shapes(merge_shapes(shapes))
+    ax.set_xlim(0,width)
+    ax.set_ylim(0,height)
+    return ax.figure
+
+def parse_spell_list(spell,registry,settings):
     if settings["draw_mode"] == "animated":
         print("List mode does not currently support animated patterns.\n-----")
         return
 
-    output_list = []
+    # identify every iota once, nested lists included, printing each as soon as it's known
+    print("This spell consists of:")
+    for record in identify_spell(spell,registry,settings):
+        print("  "*record["depth"]+record_label(record,braces=True))
 
-    # create figure to plot patterns into
-    rows = math.ceil(len(spell)/settings["grid_dims"][0])
-    cols = len(spell) if rows==1 else settings["grid_dims"][0]
-    fig = plt.figure(figsize=(cols+1,rows+1))
-    index = 1
-
-    # interpret each iota
-    indents = meta
-    for pattern_data in spell:
-        iota = pattern_data[0]
-        
-        # create subplot for this pattern
-        ax = fig.add_subplot(rows,cols,index,aspect="equal")
-        ax.axis("off")
-        index += 1
-        
-        # add result to list of outputs
-        if name := main(pattern_data,registry,settings,ax): output_list.append(name)
-        elif iota[0]=="[" or meta: output_list.append(iota)
-        else: output_list.append("NON-PATTERN: "+iota)
-
-        # indentation handling
-        if name == "Introspection":
-            output_list[-1] = ("{",indents)
-            indents += 1
-        elif name == "Retrospection":
-            indents -= 1
-            output_list[-1] = ("}",indents)
-        else:
-            output_list[-1] = (output_list[-1],indents)
-
-        # draw placeholder symbol for non-pattern or meta-eval
-        if iota[0] == "[":
-            ax.plot(0,0,marker="$[]$",ms=50,c=settings["monochrome_color"])
-        elif iota[0] == "(":
-            ax.plot(0,0,marker="$\u27E8\u27E9$",ms=50,c=settings["monochrome_color"])
-        elif iota.replace(".","",1).isnumeric():
-            ax.plot(0,0,marker="$#$",ms=50,c=settings["monochrome_color"])
-        elif iota in ("Null","arimfexendrapuse"):
-            ax.plot(0,0,marker="$?$",ms=50,c=settings["monochrome_color"])
-        elif not (meta or name):
-            ax.plot(0,0,marker="$@$",ms=50,c=settings["monochrome_color"])
-    
-    # print result line by line
-    if not meta: print("This spell consists of:")
-    for name in output_list:
-        if name[0][0]=="[":
-            print("  "*name[1]+"[")
-            parse_spell_list(string_to_spell(name[0],False),registry,settings,name[1]+1)
-            print("  "*name[1]+"]")
-        elif name[0][-1]==")":
-            print("  "*name[1]+name[0].replace(";",","))
-        else:
-            print("  "*name[1]+name[0])
-
-    # print final figure
-    if meta or settings["draw_mode"] == "disabled":
-        plt.close()
-    elif len(output_list) > settings["grid_dims"][2]:
-        plt.close()
-        print("Warning - too many patterns for visual display")
-    else:
-        fig.tight_layout(pad=0)
-        plt.show()
+    # then draw the top-level iotas, a page at a time if there are too many to fit in one grid
+    if settings["draw_mode"] != "disabled":
+        pages = list(spell_pages(spell,settings))
+        for number,page in enumerate(pages,1):
+            if len(pages) > 1: print("Showing page "+str(number)+" of "+str(len(pages))+".")
+            plot_spell_list(page,settings,len(pages)>1)
+            with timed("show"): plt.show()
 
-    if not meta: print("-----")
+    print("-----")
 
-def parse_from_file(filename,registry,settings):
+def last_line(data,size):
+    # reads backwards from the end of the file until it has the whole last line with something on it
+    start = size
+    tail = b""
+    while start > 0 and b"\n" not in tail.strip():
+        block = min(start,4096)
+        start -= block
+        data.seek(start)
+        tail = data.read(block)+tail
+    data.seek(0)
+    return tail.strip().rsplit(b"\n",1)[-1].strip()
+
+def iter_spell_file(filename,use_mmap=False):
+    # yields the iotas in a spell file as they're read, so the whole file never has to be held in memory
+    # nested lists written over several lines are built up as they go and come out as a single list iota
+    with open(filename,mode="rb") as file:
+        size = path.getsize(filename)
+        data = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ) if use_mmap and size else file
+        try:
+            # the last line is checked up front, so the outer intro/retro can be dropped without reading ahead
+            closed = last_line(data,size) == b"}"
+            lines = (line.strip() for line in iter(data.readline,b""))
+            lines = (line.decode() for line in lines if line)
+            first = next(lines,None)
+            if first is None: return
+            wrapped = first == "{" and closed
+            if not wrapped: lines = chain([first],lines)
+
+            nested = []
+            held = None
+            for line in lines:
+                # with the wrapper removed, each line is held back by one so the closing brace is never used
+                if wrapped:
+                    line,held = held,line
+                    if line is None: continue
+                if line == "[":
+                    nested.append([])
+                elif line == "]" and nested:
+                    iota = Iota("list",None,nested.pop())
+                    if nested: nested[-1].append(iota)
+                    else: yield iota
+                elif nested:
+                    nested[-1] += parse_iotas(line)
+                else:
+                    yield from parse_iotas(line)
+
+            # close any lists the file left open
+            while nested:
+                iota = Iota("list",None,nested.pop())
+                if nested: nested[-1].append(iota)
+                else: yield iota
+        finally:
+            if data is not file: data.close()
+
+def read_spell_file(filename,settings):
+    # returns the file's iotas, still unread, and whether to add an intro/retro wrapper around them
     if filename.startswith("by_hand"):
         wrapper = False
         filename = filename[8:]
     else:
         wrapper = True
 
-    # get list of lines from file
-    try:
-        with open(filename,mode="r") as file: lines = file.readlines()
-    except FileNotFoundError:
+    if not path.isfile(filename):
         print("Error - the file '"+filename+"' could not be found.")
         print("-----")
-        return None
-
-    # remove outer intro/retro if present
-    if lines[0].strip() == "{" and lines[-1].strip() == "}":
-        lines = lines[1:-1]
+        return (None,wrapper)
+    return (iter_spell_file(filename,settings["file_mmap"]=="on"),wrapper)
 
-    # convert list of lines into readable string
-    spell_string = ""
-    for line in lines:
-        line = line.strip()
-        if line:
-            if line == "[": spell_string += line
-            elif line == "]": spell_string = spell_string[:-2] + line + ", "
-            else: spell_string += line + ", "
-
-    spell_string = "["+spell_string[:-2]+"]"
+def parse_from_file(filename,registry,settings):
+    raw_list,wrapper = read_spell_file(filename,settings)
+    if raw_list is None: return None
 
-    # parse string in list mode
+    # parse file in list mode
     settings["list_mode"] = True
-    parse_spell_list(string_to_spell(spell_string,wrapper),registry,settings)
+    with timed("parse"): spell = list(format_iotas(raw_list,registry,settings,wrapper))
+    parse_spell_list(spell,registry,settings)
     settings["list_mode"] = False
   
+def identify_spell(spell,registry,settings,depth=0,meta=False):
+    # yields one record per iota, recursing into nested lists
+    # iotas inside nested lists are just data, so they aren't flagged as non-patterns
+    for iota in spell:
+        record = {"iota":iota.text,"name":None,"angle_sig":None,"start_dir":None,"valid":False,"depth":depth,"count":iota.count}
+        if iota.kind == "list":
+            yield dict(record,iota="[",name="[")
+            yield from identify_spell(iota.value,registry,settings,depth+1,True)
+            yield dict(record,iota="]",name="]")
+            continue
+        elif iota.kind != "pattern":
+            yield dict(record,name=iota.text if meta else "NON-PATTERN: "+iota.text)
+            continue
+        angle_sig,start_dir,force_mono = iota.value
+
+        with timed("geometry"): plot_data = convert_to_points(angle_sig,start_dir,settings)
+        x_vals,y_vals,points = plot_data[0],plot_data[1],plot_data[4]
+        with timed("identify"): name = registry[5].identify(angle_sig,start_dir,points if x_vals and y_vals else None)
+        record.update(angle_sig=angle_sig,start_dir=start_dir,valid=bool(x_vals and y_vals))
+        if not record["valid"]: name = "Invalid Pattern ("+("self-overlapping" if y_vals else "unreadable")+")"
+        elif not name: name = "Unknown Pattern ("+angle_sig+")"
+        record["name"] = name
+
+        # introspection and retrospection indent everything between them, same as list mode
+        if name == "Retrospection": depth -= 1
+        record["depth"] = depth
+        if name == "Introspection": depth += 1
+        yield record
+
+def record_label(record,braces=False):
+    # list mode shows introspection and retrospection as braces
+    if braces and record["name"] == "Introspection": return "{"
+    elif braces and record["name"] == "Retrospection": return "}"
+    elif record["count"] > 1: return record["name"]+" ×"+str(record["count"])
+    return record["name"]
+
+def spell_from_input(raw_input,registry,settings):
+    # turns anything the main prompt accepts, apart from the menus, into a spell
+    # returns the spell and whether the input was a list, or None if a file couldn't be read
+    # spells from files are only read as they're iterated over
+    if raw_input.endswith(".txt"):
+        raw_list,wrapper = read_spell_file(raw_input,settings)
+        if raw_list is None: return (None,True)
+        return (format_iotas(raw_list,registry,settings,wrapper),True)
+    elif raw_input.startswith("["):
+        return (string_to_spell(raw_input,registry,settings),True)
+    elif raw_input.startswith("by_hand") and "[" in raw_input:
+        raw_input = raw_input[raw_input.find("["):]
+        return (string_to_spell(raw_input,registry,settings,False),True)
+    else:
+        if raw_input.startswith("by_hand"): raw_input = raw_input[8:]
+        return ([pattern_iota(raw_input,registry,settings)],False)
+
+def identify_input(raw_input,registry,settings):
+    spell = spell_from_input(raw_input,registry,settings)[0]
+    if spell: yield from identify_spell(spell,registry,settings)
+
+def run_identify(args,registry,settings):
+    settings["list_mode"] = True
+    inputs = args.inputs or (line.strip() for line in sys.stdin)
+    for raw_input in inputs:
+        if not raw_input: continue
+        for record in identify_input(raw_input,registry,settings):
+            if args.jsonl: print(json.dumps(record))
+            else: print("  "*record["depth"]+record_label(record))
+        sys.stdout.flush()
+
+def run_encode(args):
+    values = args.values or (line.strip() for line in sys.stdin)
+    for value,result in encode_numbers(value for value in values if value).items():
+        if isinstance(result,ValueError): print("Error - "+str(result)+".",file=sys.stderr)
+        else: print(value+"\t"+hexpattern_string(*result))
+    sys.stdout.flush()
+
+def render_pattern(pattern_data,settings,filename):
+    # draw a single pattern straight to an image file, returning the file's full name
+    angle_sig,start_dir,force_mono = pattern_data
+    plot_data = convert_to_points(angle_sig,start_dir,settings)
+    if not (plot_data[0] and plot_data[1]): return None
+    if settings["draw_mode"] == "animated":
+        filename += "."+settings["anim_format"]
+        hex_anim.save_animation(plot_data,settings,filename)
+        return filename
+    elif settings["image_format"] == "svg":
+        with open(filename+".svg",mode="w") as file: file.write(pattern_svg(plot_data,force_mono,settings))
+        return filename+".svg"
+    elif settings["raster_backend"] == "pillow":
+        pattern_png(plot_data,force_mono,settings,filename+".png")
+        return filename+".png"
+    load_pyplot()
+    if settings["render_cache"] == "on":
+        copyfile(cached_render(pattern_data,plot_data,settings,[4,4]),filename+".png")
+        return filename+".png"
+    ax = new_pattern_axes(4)
+    plot_pattern(plot_data,force_mono,settings,ax)
+    ax.figure.savefig(filename+".png")
+    plt.close(ax.figure)
+    return filename+".png"
+
+def render_spell(spell,settings,filename,paged=False):
+    # draw a spell grid (or one page of one) straight to an image file, returning the file's full name
+    fig = plot_spell_list(spell,settings,paged)
+    with timed("save"): fig.savefig(filename+".png")
+    plt.close(fig)
+    return filename+".png"
+
+def combine_pages(files,filename,page_layout):
+    # stacks the pages of a spell into one tall sheet, or collects them into a single PDF, returning its full name
+    from PIL import Image
+    if page_layout == "pdf":
+        filename += ".pdf"
+        pages = [Image.open(name).convert("RGB") for name in files]
+        pages[0].save(filename,save_all=True,append_images=pages[1:],resolution=100)
+    else:
+        # the pages are only opened for their sizes at first, so just one is held in memory at a time
+        filename += ".png"
+        sizes = [Image.open(name).size for name in files]
+        sheet = Image.new("RGB",(max(width for width,height in sizes),sum(height for width,height in sizes)),"white")
+        top = 0
+        for name,(width,height) in zip(files,sizes):
+            with Image.open(name) as page: sheet.paste(page.convert("RGB"),(0,top))
+            top += height
+        sheet.save(filename)
+    for name in files: remove(name)
+    return filename
+
+def init_export_worker(registry,settings):
+    # every worker gets its own copy of the registry and settings, and a non-interactive matplotlib
+    # matplotlib is only imported if something actually needs it, which SVG and Pillow exports don't
+    global export_state,hex_anim
+    environ["MPLBACKEND"] = "Agg"
+    if settings["draw_mode"] == "animated":
+        try:
+            import hex_anim
+        except ImportError:
+            settings["anim_speed"] = "N/A"
+    settings["output_path"] = "none"
+    export_state = (registry,settings)
+
+def is_list_input(raw_input):
+    # whether spell_from_input reads an input as a spell rather than a single pattern
+    return raw_input.endswith(".txt") or raw_input.startswith("[") or (raw_input.startswith("by_hand") and "[" in raw_input)
+
+def export_jobs(inputs,out,registry,settings):
+    # spells are read and split into pages here rather than in the workers,
+    # so the pages of one long spell can be drawn at the same time
+    # everything else goes to the workers as it is
+    # files are numbered by input position, so the same inputs always produce the same names
+    width = len(str(len(inputs)))
+    settings["list_mode"] = True
+    for i,raw_input in enumerate(inputs,1):
+        prefix = path.join(out,str(i).zfill(width)+"_")
+        # list mode can't draw animated patterns, so there's no point reading the spell then
+        if is_list_input(raw_input) and settings["draw_mode"] != "animated":
+            spell = spell_from_input(raw_input,registry,settings)[0]
+            if spell:
+                if raw_input.endswith(".txt"): prefix += path.splitext(path.basename(raw_input))[0]
+                else: prefix += "spell"
+                pages = list(spell_pages(spell,settings))
+                for number,page in enumerate(pages,1):
+                    yield (raw_input,prefix,(number,len(pages),page))
+                continue
+        yield (raw_input,prefix,None)
+
+def export_job(job,overrides=None):
+    # runs inside a worker, returning this input's manifest entry
+    # overrides are settings to change for this job only
+    raw_input,prefix,page = job
+    registry,settings = export_state
+    if overrides: settings = dict(settings,**overrides)
+    record = {"input":raw_input,"file":None,"error":None,"page":None}
+
+    settings["list_mode"] = True
+    # one input that fails to draw is reported in its own entry, rather than stopping the whole batch
+    try:
+        if page:
+            number,count,spell = page
+            if count > 1:
+                record["page"] = number
+                prefix += "_"+str(number).zfill(len(str(count)))
+            record["file"] = render_spell(spell,settings,prefix,count>1)
+        # any spell that gets this far couldn't be read, or can't be drawn - export_jobs has already tried to read it,
+        # and reported it if it couldn't
+        elif is_list_input(raw_input):
+            if settings["draw_mode"] == "animated": record["error"] = "list mode does not support animated patterns"
+            elif raw_input.endswith(".txt"): record["error"] = "file not found"
+            else: record["error"] = "spell is empty"
+        else:
+            spell = spell_from_input(raw_input,registry,settings)[0]
+            if spell[0].kind != "pattern":
+                record["error"] = "not a valid pattern"
+            else:
+                settings["list_mode"] = False
+                angle_sig,start_dir = spell[0].value[:2]
+                # very long signatures would make for an invalid filename
+                if len(angle_sig) > 100: angle_sig = angle_sig[:100]+"_"
+                record["file"] = render_pattern(spell[0].value,settings,prefix+start_dir+"_"+angle_sig)
+                if not record["file"]: record["error"] = "pattern is invalid or overlaps itself"
+    except Exception as error:
+        record["file"] = None
+        record["error"] = " ".join(str(error).split()) or type(error).__name__
+    return record
+
+def run_export(args,registry,settings):
+    # fan every input out across a pool of processes, then write a manifest of what was produced
+    inputs = [raw_input for raw_input in (args.inputs or (line.strip() for line in sys.stdin)) if raw_input]
+    makedirs(args.out,exist_ok=True)
+    if args.draw_mode: settings["draw_mode"] = args.draw_mode
+    if args.format: settings["image_format"] = args.format
+    if args.backend: settings["raster_backend"] = args.backend
+    if args.pages: settings["page_layout"] = args.pages
+
+    jobs = list(export_jobs(inputs,args.out,registry,settings))
+    manifest = []
+    pages = []
+    with ProcessPoolExecutor(max_workers=args.workers,initializer=init_export_worker,initargs=(registry,settings)) as pool:
+        for (raw_input,prefix,page),record in zip(jobs,pool.map(export_job,jobs)):
+            # the pages of a spell come back in order, and can be put together once the last one is done
+            if page and page[1] > 1 and settings["page_layout"] != "pages":
+                pages.append(record)
+                if page[0] < page[1]: continue
+                errors = [record["error"] for record in pages if record["error"]]
+                if errors:
+                    # a spell with a page that couldn't be drawn gets no sheet at all
+                    for record in pages:
+                        if record["file"]: remove(record["file"])
+                    record = {"input":raw_input,"file":None,"error":errors[0],"page":None}
+                else:
+                    record = {"input":raw_input,"file":combine_pages([record["file"] for record in pages],prefix,settings["page_layout"]),"error":None,"page":None}
+                pages = []
+            manifest.append(record)
+            print(record["file"] or "Error - "+record["input"]+": "+record["error"])
+
+    with open(path.join(args.out,"manifest.json"),mode="w") as file:
+        json.dump(manifest,file,indent=2)
+
+def serve_job(job,overrides):
+    # runs inside a worker for the service, returning the image's contents and extension, or None and an error
+    record = export_job(job,overrides)
+    if not record["file"]: return (None,record["error"])
+    with open(record["file"],mode="rb") as file: data = file.read()
+    remove(record["file"])
+    return (data,path.splitext(record["file"])[1][1:])
+
+def run_serve(args,registry,settings):
+    # a local HTTP service, so other programs can identify and draw patterns without starting this one every time
+    # identifying happens in the request threads, while drawing is handed to a fixed pool of worker processes
+    # the service's modules aren't needed anywhere else, so they're only imported here
+    from concurrent.futures import TimeoutError
+    from http.server import BaseHTTPRequestHandler
+    from http.server import ThreadingHTTPServer
+    from tempfile import TemporaryDirectory
+    from threading import BoundedSemaphore
+    from urllib.parse import parse_qs
+    from urllib.parse import urlsplit
+
+    settings["list_mode"] = True
+    if args.draw_mode: settings["draw_mode"] = args.draw_mode
+    workers = args.workers or cpu_count()
+    pool = ProcessPoolExecutor(max_workers=workers,initializer=init_export_worker,initargs=(registry,settings))
+    # at most two renders per worker are let in at once, and the rest wait up to the timeout for a turn
+    slots = BoundedSemaphore(workers*2)
+    content_types = {"png":"image/png","svg":"image/svg+xml","gif":"image/gif","webp":"image/webp"}
+    # animated patterns need hex_anim, which the workers only load if the service was started in animated mode
+    draw_modes = ("intersect","monochrome","gradient",settings["draw_mode"])
+
+    class ServiceHandler(BaseHTTPRequestHandler):
+        # HTTP/1.1 keeps connections open between requests, and idle ones are closed after the timeout
+        # responses are small, so they go out straight away rather than waiting on Nagle's algorithm
+        protocol_version = "HTTP/1.1"
+        timeout = args.timeout
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self.respond(parse_qs(urlsplit(self.path).query))
+
+        def do_POST(self):
+            # long spells can be sent as the request body instead of in the URL
+            query = parse_qs(urlsplit(self.path).query)
+            body = self.rfile.read(int(self.headers.get("Content-Length",0))).decode().strip()
+            if body: query["input"] = [body]
+            self.respond(query)
+
+        def send(self,status,content_type,data,headers=None):
+            if isinstance(data,str): data = data.encode()
+            self.send_response(status)
+            self.send_header("Content-Type",content_type)
+            self.send_header("Content-Length",str(len(data)))
+            for name,value in (headers or {}).items(): self.send_header(name,value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def respond(self,query):
+            raw_input = query.get("input",[""])[0].strip()
+            if not raw_input: return self.send(400,"text/plain","Missing input")
+            # the service shouldn't read whatever files it's asked to
+            if raw_input.endswith(".txt"): return self.send(400,"text/plain","Spell files can't be read through the service")
+            try:
+                match urlsplit(self.path).path:
+                    case "/identify":
+                        self.send(200,"application/json",json.dumps(list(identify_input(raw_input,registry,settings))))
+                    case "/translate":
+                        lines = ["  "*record["depth"]+record_label(record,braces=True) for record in identify_input(raw_input,registry,settings)]
+                        self.send(200,"text/plain; charset=utf-8","\n".join(lines))
+                    case "/render":
+                        self.render(raw_input,query)
+                    case _:
+                        self.send(404,"text/plain","Unknown endpoint")
+            except Exception as error:
+                self.send(500,"text/plain; charset=utf-8","Error - "+str(error))
+
+        def render(self,raw_input,query):
+            overrides = {}
+            if "draw_mode" in query:
+                if query["draw_mode"][0] not in draw_modes: return self.send(400,"text/plain","Unsupported draw_mode")
+                overrides["draw_mode"] = query["draw_mode"][0]
+            if "format" in query:
+                if query["format"][0] not in ("png","svg"): return self.send(400,"text/plain","Unsupported format")
+                overrides["image_format"] = query["format"][0]
+            page = query.get("page",["1"])[0]
+            if not page.isdigit(): return self.send(400,"text/plain","Invalid page")
+
+            # spells are split into pages here, and only the page that was asked for gets drawn
+            with TemporaryDirectory() as folder:
+                jobs = list(export_jobs([raw_input],folder,registry,dict(settings,**overrides)))
+                if not 1 <= int(page) <= len(jobs): return self.send(404,"text/plain","No such page")
+                if not slots.acquire(timeout=args.timeout): return self.send(503,"text/plain","Too many renders in progress")
+                try:
+                    future = pool.submit(serve_job,jobs[int(page)-1],overrides)
+                except Exception:
+                    slots.release()
+                    raise
+                # the slot is only given back once the render is really done, since a render that timed out
+                # keeps its worker busy until it finishes
+                future.add_done_callback(lambda future: slots.release())
+                try:
+                    data,kind = future.result(timeout=args.timeout)
+                except TimeoutError:
+                    return self.send(504,"text/plain","Render timed out")
+            # drawing errors come back as the error text rather than being raised, see export_job
+            if data is None: return self.send(422,"text/plain; charset=utf-8","Error - "+kind)
+            self.send(200,content_types.get(kind,"application/octet-stream"),data,{"X-Page-Count":str(len(jobs))})
+
+    server = ThreadingHTTPServer((args.host,args.port),ServiceHandler)
+    print("Serving on http://"+args.host+":"+str(server.server_address[1])+" - press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown(cancel_futures=True)
+
+# the registry is kept in SQLite so single entries can be added or removed without rewriting the whole file,
+# and so other tools can read it while the program is running
+# bump registry_version and add an upgrade step to open_registry whenever the tables change
+registry_file = "pattern_registry.db"
+registry_version = 1
+
+def open_registry(filename=registry_file):
+    db = sqlite3.connect(filename)
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    if version == 0:
+        # a new file gets the latest tables, so it's stamped with the latest version
+        db.executescript("""
+            CREATE TABLE patterns (angle_sig TEXT PRIMARY KEY, name TEXT NOT NULL);
+            CREATE INDEX patterns_name ON patterns (name);
+            CREATE TABLE great_spells (shape TEXT PRIMARY KEY, name TEXT NOT NULL);
+            CREATE INDEX great_spells_name ON great_spells (name);
+            CREATE TABLE names (name TEXT PRIMARY KEY, alias_of TEXT, angle_sig TEXT, start_dir TEXT, great INTEGER);
+            CREATE INDEX names_alias_of ON names (alias_of);
+        """+"PRAGMA user_version = "+str(registry_version)+";")
+    elif version > registry_version:
+        db.close()
+        raise ValueError(filename+" was saved by a newer version of this program")
+    return db
+
+@contextmanager
+def registry_db(filename=registry_file):
+    # everything written inside one of these blocks is committed together
+    db = open_registry(filename)
+    try:
+        with db: yield db
+    finally:
+        db.close()
+
+def store_pattern(db,anglesig,name):
+    db.execute("INSERT OR REPLACE INTO patterns VALUES (?,?)",(anglesig,name))
+
+def store_great_spell(db,key,name):
+    db.execute("INSERT OR REPLACE INTO great_spells VALUES (?,?)",(json.dumps(key),name))
+
+def store_name(db,name,entry):
+    if entry[0]: db.execute("INSERT OR REPLACE INTO names (name,alias_of) VALUES (?,?)",(name,entry[1]))
+    else: db.execute("INSERT OR REPLACE INTO names (name,angle_sig,start_dir,great) VALUES (?,?,?,?)",(name,*entry[1:]))
+
+def read_registry(db):
+    patterns = dict(db.execute("SELECT angle_sig,name FROM patterns ORDER BY rowid"))
+    great_spells = {tuple(map(tuple,json.loads(shape))):name for shape,name in db.execute("SELECT shape,name FROM great_spells ORDER BY rowid")}
+    names = {}
+    for name,alias_of,anglesig,startdir,great in db.execute("SELECT name,alias_of,angle_sig,start_dir,great FROM names ORDER BY rowid"):
+        if alias_of is not None: names[name] = (True,alias_of)
+        else: names[name] = (False,anglesig,startdir,bool(great))
+    return [patterns,great_spells,names,True]
+
+def save_registry(registry,filename=registry_file):
+    # write out only the entries that differ from what's already saved
+    # nothing was loaded if there's no registry yet, so there's nothing to write and no empty file should be made
+    if registry[0] is None: return
+    with registry_db(filename) as db:
+        saved = read_registry(db)
+        for anglesig in saved[0].keys()-registry[0].keys():
+            db.execute("DELETE FROM patterns WHERE angle_sig=?",(anglesig,))
+        for anglesig,name in registry[0].items():
+            if saved[0].get(anglesig) != name: store_pattern(db,anglesig,name)
+        for key in saved[1].keys()-registry[1].keys():
+            db.execute("DELETE FROM great_spells WHERE shape=?",(json.dumps(key),))
+        for key,name in registry[1].items():
+            if saved[1].get(key) != name: store_great_spell(db,key,name)
+        for name in saved[2].keys()-registry[2].keys():
+            db.execute("DELETE FROM names WHERE name=?",(name,))
+        for name,entry in registry[2].items():
+            if saved[2].get(name) != entry: store_name(db,name,entry)
+
+def migrate_registry(old_file,new_file=registry_file):
+    # copy a registry saved by older versions into a new SQLite file, leaving the old file in place
+    with open(old_file,mode="rb") as file:
+        registry = pickle.load(file)
+    # registries saved by older versions store six rotated pointlists per great spell
+    if isinstance(registry[1],list):
+        registry[1] = convert_great_spells(registry[1])
+    if path.isfile(new_file+".tmp"): remove(new_file+".tmp")
+    save_registry(registry,new_file+".tmp")
+    replace(new_file+".tmp",new_file)
+    print("Moved the pattern registry from "+old_file+" to "+new_file,file=sys.stderr)
+
+def load_registry():
+    # load registry for pattern and great spell names
+    if not path.isfile(registry_file) and path.isfile("pattern_registry.pickle"):
+        migrate_registry("pattern_registry.pickle")
+    if not path.isfile(registry_file):
+        print("Warning - "+registry_file+" not found",file=sys.stderr)
+        registry = [None,None,None,True,None]
+    else:
+        with registry_db() as db:
+            registry = read_registry(db)
+        registry.append(build_name_index(registry[2]))
+    registry.append(PatternIdentifier(registry))
+    return registry
+
+default_settings = {"draw_mode":"intersect",
+                    "output_path":"none",
+                    "scale_factor":5,
+                    "arrow_scale":1.2,
+                    "grid_dims":[9,5,43],
+                    "intersect_colors":["#ff6bff","#a81ee3","#6490ed","#b189c7"],
+                    "animated_colors":["#a81ee3","#ff6bff","#6bc9e8","#547dd6"],
+                    "gradient_colormap":"cool",
+                    "monochrome_color":"#a81ee3",
+                    "identify_pattern":"on",
+                    "list_mode":False,
+                    "anim_speed":10,
+                    "anim_format":"gif",
+                    "image_format":"png",
+                    "raster_backend":"pillow",
+                    "page_layout":"pages",
+                    "render_cache":"on",
+                    "cache_path":"render_cache",
+                    "cache_size":100,
+                    "file_mmap":"off",
+                    "timing":"off"}
+
+def load_settings():
+    # load config settings, filling in anything added since the file was last saved
+    try:
+        with open("settings.json",mode="r") as file:
+            settings = dict(default_settings,**json.load(file))
+    except FileNotFoundError:
+        print("Warning - settings.json not found",file=sys.stderr)
+        settings = json.loads(json.dumps(default_settings))
+    return settings
+
 def configure_settings(registry,settings):
     while True:
         print("-----\nSettings Menu - Enter a number to edit the associated setting.")
@@ -666,6 +1840,10 @@ def configure_settings(registry,settings):
                 print("Provide a path to a folder for pattern images to be saved to.")
                 print("For the current folder, enter 'here'. To disable image saving, enter 'none'.")
                 settings["output_path"] = input("> ")
+                if settings["output_path"] != "none":
+                    print("Save still images as 'png' or 'svg'? Press enter to keep the current format ("+settings["image_format"]+").")
+                    image_format = input("> ").strip().lower()
+                    if image_format in ("png","svg"): settings["image_format"] = image_format
                 print("Saved new output path.")
             case 3:
                 while True:
@@ -678,9 +1856,10 @@ def configure_settings(registry,settings):
                     print("6 - Edit arrow scale factor (Current: "+str(settings["arrow_scale"])+")")
                     print("7 - Edit list-plot dimensions (Current: "+str(settings["grid_dims"][0])+"×"+str(settings["grid_dims"][1])+")")
                     print("8 - Edit animation speed (Current: "+str(settings["anim_speed"])+")")
-                    print("9 - Back to main menu")
+                    print("9 - Select animation file format (Current: "+settings["anim_format"]+")")
+                    print("10 - Back to main menu")
                     choice2 = int(input("> "))
-                    if(choice2!=9): print("-----")
+                    if(choice2!=10): print("-----")
                     match choice2:
                         case 1:
                             print("Select Intersect Mode Colors")
@@ -709,6 +1888,7 @@ def configure_settings(registry,settings):
                             print("Enter a colormap to be used for drawing lines in gradient mode.")
                             print("Alternatively, enter 'list' to display a list of all available colormaps.")
                             choice = input("> ")
+                            load_pyplot()
                             if(choice=="list"):
                                 print(colormaps)
                             elif(choice in colormaps):
@@ -754,6 +1934,15 @@ def configure_settings(registry,settings):
                                     print("Saved new animation speed.")
                                 else:
                                     print("Invalid input.")
+                        case 9:
+                            print("Select Animation File Format")
+                            print("Saved animations can be written as 'gif', 'png' (animated PNG), or 'webp'.")
+                            new_format = input("> ").strip().lower()
+                            if new_format in ("gif","png","webp"):
+                                settings["anim_format"] = new_format
+                                print("Saved new animation file format.")
+                            else:
+                                print("Invalid input.")
                         case _: break
             case 4:
                 if(settings["identify_pattern"]=="on"): settings["identify_pattern"] = "off"
@@ -780,23 +1969,7 @@ def configure_settings(registry,settings):
                         print("Saved '"+anglesig+" = "+name+"' to current pattern registry.")
                         print("To keep this spell between sessions, make sure to save your settings to file.")
                     elif(great=="y"):
-                        for direction in ["east","west","northeast","northwest","southeast","southwest"]:
-                            new_x,new_y = convert_to_points(anglesig,direction,settings)[:2]
-                            points = []
-                            for i in range(len(new_x)):
-                                points.append([new_x[i],new_y[i]])
-                            for point in points:
-                                    new_list = [point]
-                                    for other_point in points:
-                                        if not(abs(point[0]-other_point[0])<0.1 and abs(point[1]-other_point[1])<0.1):
-                                            new_list.append(other_point)
-                                    points = new_list
-                            lowest = [min(new_x),min(new_y)]
-                            for i in range(len(points)):
-                                points[i][0] -= lowest[0]
-                                points[i][1] -= lowest[1]
-                            registry[1].append([points,name])
-                        plt.close()
+                        registry[1][great_spell_key(lattice_walk(anglesig,"east")[0])] = name
                         registry[2][name] = (False,anglesig,startdir,True)
                         print("Saved '"+name+"' to current pattern registry as a great spell.")
                         print("To keep this spell between sessions, make sure to save your settings to file.")
@@ -820,16 +1993,14 @@ def configure_settings(registry,settings):
                         print("Removed '"+anglesig+" = "+name+"' from current pattern registry.")
                         print("To permanently remove this spell, make sure to save your settings to file.")
                     elif(great=="y"):
-                        (target_x,target_y,scale,start_angle) = convert_to_points(anglesig,"east",settings)
-                        plt.close()
-                        name = gs_lookup(target_x,target_y,registry[1])
+                        name = registry[1].get(great_spell_key(lattice_walk(anglesig,"east")[0]))
                         if not name:
                             print("That angle signature doesn't match any registered great spell.")
                             continue
                         elif(name[-8:]!="(Custom)"):
                             print("Can't deregister '"+name+"' because it's not a custom great spell.")
                             continue
-                        registry[1] = [entry for entry in registry[1] if entry[1]!=name]
+                        registry[1] = {key:spell for key,spell in registry[1].items() if spell!=name}
                         del registry[2][name]
                         print("Removed '"+name+"' from current pattern registry.")
                         print("To permanently remove this spell, make sure to save your settings to file.")
@@ -882,8 +2053,7 @@ def configure_settings(registry,settings):
             case 7:
                 with open("settings.json",mode="w") as file:
                     json.dump(settings,file)
-                with open("pattern_registry.pickle",mode="wb") as file:
-                    pickle.dump(registry,file)
+                save_registry(registry)
                 print("Settings saved to file.")
             case 8:
                 return
@@ -912,6 +2082,10 @@ def admin_configure(registry,settings):
             case 1:
                 for name in settings:
                     print(name+": "+str(settings[name]))
+                print("Render cache: "+str(cache_stats["hits"])+" hits, "+str(cache_stats["misses"])+" misses, "+str(cache_stats["evictions"])+" evictions this session")
+                identifier = registry[5]
+                print("Identification cache: "+str(identifier.hits)+" hits, "+str(identifier.misses)+" misses ("+format(identifier.hit_rate(),".0%")+" hit rate), "
+                      +str(identifier.evictions)+" evictions since the registry last changed")
             case 2:
                 print("Add/Remove New Settings Field")
                 print("Add a new name-value pair to the settings file.")
@@ -966,8 +2140,8 @@ def admin_configure(registry,settings):
                     print("Registry print cancelled.")
                     continue
                 print("\n")
-                for pair in registry[1]:
-                    print(str(pair[0])+"\n--> "+pair[1]+"\n")
+                for key in registry[1]:
+                    print(str(key)+"\n--> "+registry[1][key]+"\n")
             case 5:
                 print("Warning - This will be a very large wall of text.")
                 print("Continue anyway? (y/n)")
@@ -998,30 +2172,17 @@ def admin_configure(registry,settings):
                     if(great=="n"):
                         registry[0][anglesig] = name
                         registry[2][name] = (False,anglesig,startdir,False)
-                        with open("pattern_registry.pickle",mode="wb") as file:
-                            pickle.dump(registry,file)
+                        with registry_db() as db:
+                            store_pattern(db,anglesig,name)
+                            store_name(db,name,registry[2][name])
                         print("Saved '"+anglesig+" = "+name+"' to pattern registry.")
                     elif(great=="y"):
-                        for direction in ["east","west","northeast","northwest","southeast","southwest"]:
-                            new_x,new_y = convert_to_points(anglesig,direction,settings)[:2]
-                            points = []
-                            for i in range(len(new_x)):
-                                points.append([new_x[i],new_y[i]])
-                            for point in points:
-                                    new_list = [point]
-                                    for other_point in points:
-                                        if not(abs(point[0]-other_point[0])<0.1 and abs(point[1]-other_point[1])<0.1):
-                                            new_list.append(other_point)
-                                    points = new_list
-                            lowest = [min(new_x),min(new_y)]
-                            for i in range(len(points)):
-                                points[i][0] -= lowest[0]
-                                points[i][1] -= lowest[1]
-                            registry[1].append([points,name])
-                        plt.close()
+                        key = great_spell_key(lattice_walk(anglesig,"east")[0])
+                        registry[1][key] = name
                         registry[2][name] = (False,anglesig,startdir,True)
-                        with open("pattern_registry.pickle",mode="wb") as file:
-                            pickle.dump(registry,file)
+                        with registry_db() as db:
+                            store_great_spell(db,key,name)
+                            store_name(db,name,registry[2][name])
                         print("Saved '"+name+"' to pattern registry as a great spell.")
                     else:
                         print("That's not a valid input.")
@@ -1037,20 +2198,20 @@ def admin_configure(registry,settings):
                         name = registry[0][anglesig]
                         del registry[0][anglesig]
                         del registry[2][name]
-                        with open("pattern_registry.pickle",mode="wb") as file:
-                            pickle.dump(registry,file)
+                        with registry_db() as db:
+                            db.execute("DELETE FROM patterns WHERE angle_sig=?",(anglesig,))
+                            db.execute("DELETE FROM names WHERE name=?",(name,))
                         print("Removed '"+anglesig+" = "+name+"' from pattern registry.")                
                     elif(great=="y"):
-                        (target_x,target_y,scale,start_angle) = convert_to_points(anglesig,"east",settings)
-                        plt.close()
-                        name = gs_lookup(target_x,target_y,registry[1])
+                        name = registry[1].get(great_spell_key(lattice_walk(anglesig,"east")[0]))
                         if not name:
                             print("That angle signature doesn't match any registered great spell.")
                             continue
-                        registry[1] = [entry for entry in registry[1] if entry[1]!=name]
+                        registry[1] = {key:spell for key,spell in registry[1].items() if spell!=name}
                         del registry[2][name]
-                        with open("pattern_registry.pickle",mode="wb") as file:
-                            pickle.dump(registry,file)
+                        with registry_db() as db:
+                            db.execute("DELETE FROM great_spells WHERE name=?",(name,))
+                            db.execute("DELETE FROM names WHERE name=?",(name,))
                         print("Removed '"+name+"' from pattern registry.") 
                     else:
                         print("That's not a valid input.")
@@ -1081,8 +2242,8 @@ def admin_configure(registry,settings):
                             great = True
                         registry[2][name] = (False,anglesig,startdir,great)
                         print("Saved new entry '"+name+" = "+anglesig+" "+startdir+"' to the registry.")
-                        with open("pattern_registry.pickle",mode="wb") as file:
-                            pickle.dump(registry,file)
+                        with registry_db() as db:
+                            store_name(db,name,registry[2][name])
                         continue
                     elif registry[2][name][0]:
                         print("'"+name+"' isn't a pattern name, it's an alias for the name "+registry[2][name][1]+".")
@@ -1094,8 +2255,8 @@ def admin_configure(registry,settings):
                         continue
                     registry[2][alias] = (True,name)
                     print("Saved '"+alias+"' as an alias for '"+name+"'.")
-                    with open("pattern_registry.pickle",mode="wb") as file:
-                        pickle.dump(registry,file)
+                    with registry_db() as db:
+                        store_name(db,alias,registry[2][alias])
 
                 # remove name/alias
                 elif choice2 == "remove":
@@ -1110,14 +2271,14 @@ def admin_configure(registry,settings):
                         entry = registry[2][alias]
                         del registry[2][alias]
                         print("Removed entry '"+alias+" = "+entry[1]+" "+entry[2]+"' from the registry.")
-                        with open("pattern_registry.pickle",mode="wb") as file:
-                            pickle.dump(registry,file)
+                        with registry_db() as db:
+                            db.execute("DELETE FROM names WHERE name=?",(alias,))
                     else:
                         name = registry[2][alias][1]
                         del registry[2][alias]
                         print("Removedalias '"+alias+"' for '"+name+"'.")
-                        with open("pattern_registry.pickle",mode="wb") as file:
-                            pickle.dump(registry,file)
+                        with registry_db() as db:
+                            db.execute("DELETE FROM names WHERE name=?",(alias,))
                 else:
                     print("That's not a valid input.")
             case 8:
@@ -1128,37 +2289,70 @@ def admin_configure(registry,settings):
             case _:
                 print("Invalid input, please try again.")
 
+def handle_input(raw_input,registry,settings):
+    # everything the prompt accepts apart from the menus
+    if raw_input.startswith("["):
+        settings["list_mode"] = True
+        parse_spell_list(string_to_spell(raw_input,registry,settings),registry,settings)
+        settings["list_mode"] = False
+    elif raw_input[-4:] == ".txt":
+        parse_from_file(raw_input,registry,settings)
+    elif raw_input.startswith("number "):
+        try:
+            angle_sig,start_dir = encode_number(raw_input[7:].strip())
+        except ValueError as error:
+            print("Error - "+str(error)+".\n-----")
+            return
+        print("Pattern: "+hexpattern_string(angle_sig,start_dir))
+        main((angle_sig,start_dir,False),registry,settings)
+    elif raw_input.startswith("by_hand"):
+        start = raw_input.find("[")
+        if start < 0:
+            main(raw_input[8:],registry,settings)
+        else:
+            settings["list_mode"] = True
+            parse_spell_list(string_to_spell(raw_input[start:],registry,settings,False),registry,settings)
+            settings["list_mode"] = False
+    else:
+        main(raw_input,registry,settings)
+
 if __name__ == "__main__":
     # change working directory to script folder
     chdir(path.dirname(path.abspath(__file__)))
+    registry = load_registry()
+    settings = load_settings()
+
+    # headless commands skip the interactive prompt entirely
+    if len(sys.argv) > 1:
+        parser = argparse.ArgumentParser(prog="hex_draw.py",description="Non-interactive hexpattern tools.")
+        commands = parser.add_subparsers(dest="command",required=True)
+        identify_cmd = commands.add_parser("identify",help="identify patterns, spells and spell files without drawing them")
+        identify_cmd.add_argument("inputs",nargs="*",help="hexpatterns, spell lists or .txt files (default: one per line from stdin)")
+        identify_cmd.add_argument("--jsonl",action="store_true",help="print one JSON record per iota")
+        export_cmd = commands.add_parser("export",help="render patterns, spells and spell files to image files in parallel")
+        export_cmd.add_argument("inputs",nargs="*",help="hexpatterns, spell lists or .txt files (default: one per line from stdin)")
+        export_cmd.add_argument("--out",default="exports",help="folder to write images and manifest.json to (default: exports)")
+        export_cmd.add_argument("--workers",type=int,default=None,help="number of worker processes (default: one per CPU)")
+        export_cmd.add_argument("--draw-mode",choices=("intersect","monochrome","gradient","animated"),help="override the saved drawing mode")
+        export_cmd.add_argument("--format",choices=("png","svg"),help="override the saved format for still images (spell grids are always PNG)")
+        export_cmd.add_argument("--pages",choices=("pages","sheet","pdf"),help="override how spells too long for one grid are saved")
+        export_cmd.add_argument("--backend",choices=("pillow","matplotlib"),help="override the saved renderer for PNG patterns")
+        encode_cmd = commands.add_parser("encode",help="find the shortest Numerical Reflection for each number")
+        encode_cmd.add_argument("values",nargs="*",help="numbers, like 42, -2.5 or 7/4 (default: one per line from stdin)")
+        serve_cmd = commands.add_parser("serve",help="run a local HTTP service for identifying and rendering")
+        serve_cmd.add_argument("--host",default="127.0.0.1",help="address to listen on (default: 127.0.0.1)")
+        serve_cmd.add_argument("--port",type=int,default=8000,help="port to listen on (default: 8000)")
+        serve_cmd.add_argument("--workers",type=int,default=None,help="number of render worker processes (default: one per CPU)")
+        serve_cmd.add_argument("--timeout",type=float,default=30,help="seconds before a render or idle connection is given up on (default: 30)")
+        serve_cmd.add_argument("--draw-mode",choices=("intersect","monochrome","gradient","animated"),help="override the saved drawing mode")
+        args = parser.parse_args()
+        match args.command:
+            case "identify": run_identify(args,registry,settings)
+            case "export": run_export(args,registry,settings)
+            case "encode": run_encode(args)
+            case "serve": run_serve(args,registry,settings)
+        sys.exit()
 
-    # load registry for pattern and great spell names
-    try:
-        with open("pattern_registry.pickle",mode="rb") as file:
-            registry = pickle.load(file)
-            registry[3] = True
-    except FileNotFoundError:
-        print("Warning - pattern_registry.pickle not found")
-        registry = [None,None,None,True]
-
-    # load config settings
-    try:
-        with open("settings.json",mode="r") as file:
-            settings = json.load(file)
-    except FileNotFoundError:
-        print("Warning - settings.json not found")
-        settings = {"draw_mode":"intersect",
-                    "output_path":"none",
-                    "scale_factor":5,
-                    "arrow_scale":1.2,
-                    "grid_dims":[9,5,43],
-                    "intersect_colors":["#ff6bff","#a81ee3","#6490ed","#b189c7"],
-                    "gradient_colormap":"cool",
-                    "monochrome_color":"#a81ee3",
-                    "identify_pattern":"on",
-                    "list_mode":False,
-                    "anim_speed":10}
-        
     # load animation module
     try:
         import hex_anim
@@ -1171,21 +2365,13 @@ if __name__ == "__main__":
         raw_input = input("Enter a hexpattern, a filename, or 'S' for settings: ")
         if raw_input=="s":
             configure_settings(registry,settings)
+            if registry[2]: registry[4] = build_name_index(registry[2])
+            registry[5] = PatternIdentifier(registry)
         elif raw_input=="admin":
             admin_configure(registry,settings)
-        elif raw_input.startswith("["):
-            settings["list_mode"] = True
-            parse_spell_list(string_to_spell(raw_input),registry,settings)
-            settings["list_mode"] = False
-        elif raw_input[-4:] == ".txt":
-            parse_from_file(raw_input,registry,settings)
-        elif raw_input.startswith("by_hand"):
-            start = raw_input.find("[")
-            if start < 0:
-                main(raw_input[8:],registry,settings)
-            else:
-                settings["list_mode"] = True
-                parse_spell_list(string_to_spell(raw_input[start:],False),registry,settings)
-                settings["list_mode"] = False
+            if registry[2]: registry[4] = build_name_index(registry[2])
+            registry[5] = PatternIdentifier(registry)
+        elif raw_input.startswith("profile "):
+            profile_input(raw_input[8:],registry,settings)
         else:
-            main(raw_input,registry,settings)
+            with timed_request(raw_input,settings): handle_input(raw_input,registry,settings)